@@ -1,16 +1,18 @@
+import sys
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
+from loguru import logger
 from scalar_fastapi import get_scalar_api_reference
 from starlette.middleware.gzip import GZipMiddleware
 
-from .constants import DESCRIPTION, STATIC, TITLE, VERSION
+from .constants import DESCRIPTION, PROFILE_PICTURE_PATH, STATIC, TITLE, VERSION, env
 from .db import init_db
-from .revocation import init_revocation_scheduler
+from .revocation import init_revocation_scheduler, load_revoked_sigs
 from .routers import (
     account_router,
     auth_router,
@@ -18,6 +20,7 @@ from .routers import (
     staff_router,
     student_router,
 )
+from .routers.common import etag_response
 
 info = {
     "title": TITLE,
@@ -28,13 +31,21 @@ info = {
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
+    # Records are handed to a background writer, so logging never blocks a request.
+    logger.remove()
+    logger.add(
+        sys.stderr, level=env.LOG_LEVEL, serialize=env.LOG_SERIALIZE, enqueue=True
+    )
     _app.mount("/STATIC", STATIC, name="STATIC")
-    init_db()
+    PROFILE_PICTURE_PATH.mkdir(parents=True, exist_ok=True)
+    await init_db()
+    await load_revoked_sigs()
     init_revocation_scheduler()
     yield
+    await logger.complete()
 
 
-app = FastAPI(**info, lifespan=lifespan)
+app = FastAPI(**info, lifespan=lifespan, default_response_class=ORJSONResponse)
 
 origins = [
     "*",
@@ -49,13 +60,16 @@ app.add_middleware(
 )
 app.add_middleware(
     GZipMiddleware,  # noqa
-    minimum_size=100,
+    # Small responses don't shrink enough to be worth compressing, and level 6
+    # compresses nearly as well as the default 9 at a fraction of the CPU.
+    minimum_size=1024,
+    compresslevel=6,
 )
 
 
 @app.get("/", tags=["Root"])
-async def root():
-    return info
+async def root(request: Request):
+    return etag_response(request, info, cache_control="public, no-cache")
 
 
 app.include_router(auth_router)
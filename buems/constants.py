@@ -1,25 +1,72 @@
-from os import getenv
+from importlib.metadata import PackageNotFoundError, metadata
 from pathlib import Path
 from tomllib import load
 
-from dotenv import find_dotenv, load_dotenv
+from dotenv import find_dotenv
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from starlette.staticfiles import StaticFiles
 
-load_dotenv(find_dotenv())
 
+class Settings(BaseSettings):
+    """
+    Settings read once from the environment (or a `.env` file) at import.
+    Missing or malformed values fail at startup rather than surfacing later.
+    """
 
-class EnvironmentVariables:
-    def __getattribute__(self, item) -> str:
-        return getenv(item)
+    model_config = SettingsConfigDict(env_file=find_dotenv(), extra="ignore")
 
+    DB_URL: str
+    SECRET_KEY: str
 
-pyproject = load(open(Path(__file__).parent.parent.joinpath("pyproject.toml"), "rb"))
-env = EnvironmentVariables()
+    # Connection pool sizing; tune per deployment (pool_size + max_overflow per worker).
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 3600
+    # Reuse the most recently returned connection, so surplus ones idle out sooner.
+    # Like the sizing above, only applies to queue pools (i.e. not to SQLite).
+    DB_POOL_USE_LIFO: bool = True
+    # Set when fronted by PgBouncer in transaction-pooling mode (avoids double-pooling).
+    DB_NULL_POOL: bool = False
+
+    LOG_LEVEL: str = "INFO"
+    # Write each log record as a JSON object, for log collectors, rather than as text.
+    LOG_SERIALIZE: bool = False
+
+    # bcrypt work factor for new hashes; existing hashes keep the cost they were made
+    # with. Each increment doubles the time taken to hash and verify. bcrypt accepts
+    # costs from 4 to 31; anything else fails at startup, not at the first hash.
+    BCRYPT_COST: int = Field(10, ge=4, le=31)
+
+
+env = Settings()
+
+try:
+    # Installed package metadata, so pyproject.toml needn't ship or be parsed.
+    _metadata = metadata("buems-api")
+    TITLE = _metadata["Name"]
+    VERSION = _metadata["Version"]
+    DESCRIPTION = _metadata["Summary"]
+except PackageNotFoundError:
+    # Running from a source checkout without the package installed.
+    with open(Path(__file__).parent.parent.joinpath("pyproject.toml"), "rb") as f:
+        _project = load(f)["project"]
+    TITLE = _project["name"]
+    VERSION = _project["version"]
+    DESCRIPTION = _project["description"]
 
-TITLE = pyproject["project"]["name"]
-VERSION = pyproject["project"]["version"]
-DESCRIPTION = pyproject["project"]["description"]
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# In-process cache of authenticated users. Kept short, as each worker has its own.
+AUTH_CACHE_TTL_SECONDS = 10
+AUTH_CACHE_MAXSIZE = 10_000
+REVOKED_SIGS_REFRESH_SECONDS = 10
+# In-process cache of exeat listings. Cleared on writes within a worker; the TTL bounds
+# how stale other workers' copies can get.
+EXEAT_LISTING_CACHE_TTL_SECONDS = 5
+EXEAT_LISTING_CACHE_MAXSIZE = 1_000
+# Rows fetched from the database at a time when streaming exeat listings.
+EXEAT_STREAM_BATCH_SIZE = 50
 MAX_PROFILE_PICTURE_SIZE = 1 * 1024 * 1024  # 1 MB
 
 STATIC_PATH = Path(__file__).parent.parent / "static"
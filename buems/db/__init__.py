@@ -26,8 +26,12 @@ from .crud import (
     update_student,
     update_user,
 )
-from .db import db_dependency, init_db
+from .db import DbDep, db_dependency, init_db, sessionmaker_instance
 from .models import (
+    EXEAT_REQUEST_STATUS_NAMES,
+    EXEAT_REQUEST_STATUSES_BY_NAME,
+    USER_TYPE_NAMES,
+    USER_TYPES_BY_NAME,
     ExeatRequest,
     ExeatRequestStatusEnum,
     RevokedToken,
@@ -37,9 +41,17 @@ from .models import (
     User,
     UserType,
     UserTypeEnum,
+    as_utc,
+    exeat_last_updated,
+    utcnow,
 )
 
 __all__ = (
+    DbDep,
+    EXEAT_REQUEST_STATUS_NAMES,
+    EXEAT_REQUEST_STATUSES_BY_NAME,
+    USER_TYPE_NAMES,
+    USER_TYPES_BY_NAME,
     DBException,
     ExeatRequest,
     ExeatRequestNotFound,
@@ -55,6 +67,7 @@ __all__ = (
     UserNotFound,
     UserType,
     UserTypeEnum,
+    as_utc,
     create_exeat_request,
     create_security_operative,
     create_staff,
@@ -66,15 +79,18 @@ __all__ = (
     delete_staff,
     delete_student,
     delete_user,
+    exeat_last_updated,
     get_exeat_request,
     get_security_operative,
     get_staff,
     get_student,
     get_user,
     init_db,
+    sessionmaker_instance,
     update_exeat_request,
     update_security_operative,
     update_staff,
     update_student,
     update_user,
+    utcnow,
 )
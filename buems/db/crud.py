@@ -1,5 +1,7 @@
 from loguru import logger
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import selectinload
+from sqlmodel import SQLModel, insert, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from .models import ExeatRequest, SecurityOperative, Staff, Student, User
 
@@ -32,137 +34,165 @@ class SecurityOperativeNotFound(DBException):
 # CRUD FUNCTIONS
 
 
+# Helpers
+async def _create(db: AsyncSession, instance: SQLModel) -> SQLModel:
+    """
+    Insert a row with a single INSERT ... RETURNING, so server-generated columns
+    (e.g. the ID) come back without a follow-up refresh.
+    """
+    model = type(instance)
+    # noinspection PyTypeChecker
+    statement = (
+        insert(model).values(**instance.model_dump(exclude_none=True)).returning(model)
+    )
+    instance = (await db.exec(statement)).scalar_one()
+    await db.commit()
+    return instance
+
+
+async def _update(
+    db: AsyncSession, model: type[SQLModel], pk: int, updates: dict
+) -> SQLModel | None:
+    """
+    Apply the non-None `updates` to a row with a single UPDATE ... RETURNING,
+    rather than a SELECT followed by an UPDATE.
+    Returns None if no row has the given primary key.
+    """
+    values = {key: value for key, value in updates.items() if value is not None}
+    if not values:
+        return await db.get(model, pk)
+    # noinspection PyTypeChecker
+    statement = update(model).where(model.id == pk).values(**values).returning(model)
+    instance = (await db.exec(statement)).scalar_one_or_none()
+    await db.commit()
+    return instance
+
+
 # User
-def create_user(db: Session, user: User) -> User:
-    logger.info("Creating user with email {}", user.email)
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+async def create_user(db: AsyncSession, user: User) -> User:
+    logger.debug("Creating user with email {}", user.email)
+    user = await _create(db, user)
     logger.info("User created with ID {}", user.id)
     return user
 
 
-def get_user(db: Session, user_id: int) -> User:
-    user: User | None = db.get(User, user_id)
+async def get_user(db: AsyncSession, user_id: int) -> User:
+    user: User | None = await db.get(User, user_id)
     if not user:
         logger.error("User with ID {} not found", user_id)
         raise UserNotFound(f"User with ID {user_id} not found")
     return user
 
 
-def update_user(db: Session, user_id: int, **updates) -> User:
-    user = get_user(db, user_id)
-    for key, value in updates.items():
-        if value is not None:
-            setattr(user, key, value)
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+async def update_user(db: AsyncSession, user_id: int, **updates) -> User:
+    user: User | None = await _update(db, User, user_id, updates)
+    if not user:
+        logger.error("User with ID {} not found", user_id)
+        raise UserNotFound(f"User with ID {user_id} not found")
     logger.info("Updated user with ID {}", user_id)
     return user
 
 
-def delete_user(db: Session, user_id: int) -> None:
-    user = get_user(db, user_id)
-    db.delete(user)
-    db.commit()
+async def delete_user(db: AsyncSession, user_id: int) -> None:
+    user = await get_user(db, user_id)
+    await db.delete(user)
+    await db.commit()
     logger.info("Deleted user with ID {}", user_id)
 
 
 # Student
-def create_student(db: Session, student: Student) -> Student:
-    logger.info(
+async def create_student(db: AsyncSession, student: Student) -> Student:
+    logger.debug(
         "Creating student with matriculation number {}", student.matriculation_number
     )
-    db.add(student)
-    db.commit()
-    db.refresh(student)
+    student = await _create(db, student)
     logger.info("Student created with ID {}", student.id)
     return student
 
 
-def get_student(db: Session, student_id: int) -> Student:
-    student: Student | None = db.get(Student, student_id)
+async def get_student(
+    db: AsyncSession, student_id: int, load_relationships: bool = False
+) -> Student:
+    # Lazy loading isn't available on an AsyncSession; selectin loads each in one query.
+    options = (
+        (selectinload(Student.requested_exeats), selectinload(Student.guardian))
+        if load_relationships
+        else ()
+    )
+    student: Student | None = await db.get(Student, student_id, options=options)
     if not student:
         logger.error("Student with ID {} not found", student_id)
         raise StudentNotFound(f"Student with ID {student_id} not found")
     return student
 
 
-def update_student(db: Session, student_id: int, **updates) -> Student:
-    student = get_student(db, student_id)
-    for key, value in updates.items():
-        if value is not None:
-            setattr(student, key, value)
-    db.add(student)
-    db.commit()
-    db.refresh(student)
+async def update_student(db: AsyncSession, student_id: int, **updates) -> Student:
+    student: Student | None = await _update(db, Student, student_id, updates)
+    if not student:
+        logger.error("Student with ID {} not found", student_id)
+        raise StudentNotFound(f"Student with ID {student_id} not found")
     logger.info("Updated student with ID {}", student_id)
     return student
 
 
-def delete_student(db: Session, student_id: int) -> None:
-    student = get_student(db, student_id)
-    db.delete(student)
-    db.commit()
+async def delete_student(db: AsyncSession, student_id: int) -> None:
+    student = await get_student(db, student_id)
+    await db.delete(student)
+    await db.commit()
     logger.info("Deleted student with ID {}", student_id)
 
 
 # Staff
-def create_staff(db: Session, staff: Staff) -> Staff:
-    logger.info("Creating staff with ID {}", staff.staff_id)
-    db.add(staff)
-    db.commit()
-    db.refresh(staff)
+async def create_staff(db: AsyncSession, staff: Staff) -> Staff:
+    logger.debug("Creating staff with ID {}", staff.staff_id)
+    staff = await _create(db, staff)
     logger.info("Staff created with ID {}", staff.id)
     return staff
 
 
-def get_staff(db: Session, staff_id: int) -> Staff:
-    staff: Staff | None = db.get(Staff, staff_id)
+async def get_staff(
+    db: AsyncSession, staff_id: int, load_relationships: bool = False
+) -> Staff:
+    options = (selectinload(Staff.addressed_exeats),) if load_relationships else ()
+    staff: Staff | None = await db.get(Staff, staff_id, options=options)
     if not staff:
         logger.error("Staff with ID {} not found", staff_id)
         raise StaffNotFound(f"Staff with ID {staff_id} not found")
     return staff
 
 
-def update_staff(db: Session, staff_id: int, **updates) -> Staff:
-    staff = get_staff(db, staff_id)
-    for key, value in updates.items():
-        if value is not None:
-            setattr(staff, key, value)
-    db.add(staff)
-    db.commit()
-    db.refresh(staff)
+async def update_staff(db: AsyncSession, staff_id: int, **updates) -> Staff:
+    staff: Staff | None = await _update(db, Staff, staff_id, updates)
+    if not staff:
+        logger.error("Staff with ID {} not found", staff_id)
+        raise StaffNotFound(f"Staff with ID {staff_id} not found")
     logger.info("Updated staff with ID {}", staff_id)
     return staff
 
 
-def delete_staff(db: Session, staff_id: int) -> None:
-    staff = get_staff(db, staff_id)
-    db.delete(staff)
-    db.commit()
+async def delete_staff(db: AsyncSession, staff_id: int) -> None:
+    staff = await get_staff(db, staff_id)
+    await db.delete(staff)
+    await db.commit()
     logger.info("Deleted staff with ID {}", staff_id)
 
 
 # Security Operative
-def create_security_operative(
-    db: Session, security_operative: SecurityOperative
+async def create_security_operative(
+    db: AsyncSession, security_operative: SecurityOperative
 ) -> SecurityOperative:
-    logger.info(
+    logger.debug(
         "Creating security operative with ID {}", security_operative.security_id
     )
-    db.add(security_operative)
-    db.commit()
-    db.refresh(security_operative)
+    security_operative = await _create(db, security_operative)
     logger.info("Security operative created with ID {}", security_operative.id)
     return security_operative
 
 
-def get_security_operative(
-    db: Session, security_operative_id: int
+async def get_security_operative(
+    db: AsyncSession, security_operative_id: int
 ) -> SecurityOperative:
-    security_operative: SecurityOperative | None = db.get(
+    security_operative: SecurityOperative | None = await db.get(
         SecurityOperative, security_operative_id
     )
     if not security_operative:
@@ -173,39 +203,42 @@ def get_security_operative(
     return security_operative
 
 
-def update_security_operative(
-    db: Session, security_operative_id: int, **updates
+async def update_security_operative(
+    db: AsyncSession, security_operative_id: int, **updates
 ) -> SecurityOperative:
-    security_operative = get_security_operative(db, security_operative_id)
-    for key, value in updates.items():
-        if value is not None:
-            setattr(security_operative, key, value)
-    db.add(security_operative)
-    db.commit()
-    db.refresh(security_operative)
+    security_operative: SecurityOperative | None = await _update(
+        db, SecurityOperative, security_operative_id, updates
+    )
+    if not security_operative:
+        logger.error("Security operative with ID {} not found", security_operative_id)
+        raise SecurityOperativeNotFound(
+            f"Security operative with ID {security_operative_id} not found"
+        )
     logger.info("Updated security operative with ID {}", security_operative_id)
     return security_operative
 
 
-def delete_security_operative(db: Session, security_operative_id: int) -> None:
-    security_operative = get_security_operative(db, security_operative_id)
-    db.delete(security_operative)
-    db.commit()
+async def delete_security_operative(
+    db: AsyncSession, security_operative_id: int
+) -> None:
+    security_operative = await get_security_operative(db, security_operative_id)
+    await db.delete(security_operative)
+    await db.commit()
     logger.info("Deleted security operative with ID {}", security_operative_id)
 
 
 # ExeatRequest
-def create_exeat_request(db: Session, exeat_request: ExeatRequest) -> ExeatRequest:
-    logger.info("Creating exeat request for student ID {}", exeat_request.student_id)
-    db.add(exeat_request)
-    db.commit()
-    db.refresh(exeat_request)
+async def create_exeat_request(
+    db: AsyncSession, exeat_request: ExeatRequest
+) -> ExeatRequest:
+    logger.debug("Creating exeat request for student ID {}", exeat_request.student_id)
+    exeat_request = await _create(db, exeat_request)
     logger.info("Exeat request created with ID {}", exeat_request.id)
     return exeat_request
 
 
-def get_exeat_request(db: Session, exeat_request_id: int) -> ExeatRequest:
-    exeat_request: ExeatRequest | None = db.get(ExeatRequest, exeat_request_id)
+async def get_exeat_request(db: AsyncSession, exeat_request_id: int) -> ExeatRequest:
+    exeat_request: ExeatRequest | None = await db.get(ExeatRequest, exeat_request_id)
     if not exeat_request:
         logger.error("Exeat request with ID {} not found", exeat_request_id)
         raise ExeatRequestNotFound(
@@ -214,20 +247,23 @@ def get_exeat_request(db: Session, exeat_request_id: int) -> ExeatRequest:
     return exeat_request
 
 
-def update_exeat_request(db: Session, exeat_request_id: int, **updates) -> ExeatRequest:
-    exeat_request = get_exeat_request(db, exeat_request_id)
-    for key, value in updates.items():
-        if value is not None:
-            setattr(exeat_request, key, value)
-    db.add(exeat_request)
-    db.commit()
-    db.refresh(exeat_request)
+async def update_exeat_request(
+    db: AsyncSession, exeat_request_id: int, **updates
+) -> ExeatRequest:
+    exeat_request: ExeatRequest | None = await _update(
+        db, ExeatRequest, exeat_request_id, updates
+    )
+    if not exeat_request:
+        logger.error("Exeat request with ID {} not found", exeat_request_id)
+        raise ExeatRequestNotFound(
+            f"Exeat request with ID {exeat_request_id} not found"
+        )
     logger.info("Updated exeat request with ID {}", exeat_request_id)
     return exeat_request
 
 
-def delete_exeat_request(db: Session, exeat_request_id: int) -> None:
-    exeat_request = get_exeat_request(db, exeat_request_id)
-    db.delete(exeat_request)
-    db.commit()
+async def delete_exeat_request(db: AsyncSession, exeat_request_id: int) -> None:
+    exeat_request = await get_exeat_request(db, exeat_request_id)
+    await db.delete(exeat_request)
+    await db.commit()
     logger.info("Deleted exeat request with ID {}", exeat_request_id)
@@ -1,39 +1,70 @@
-from typing import Any
+from collections.abc import AsyncIterator
+from typing import Annotated
 
-from sqlalchemy.orm import sessionmaker
-from sqlmodel import Session, SQLModel, create_engine
+from fastapi import Depends
+from sqlalchemy import NullPool, QueuePool, make_url
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from ..constants import env
 from .models import ExeatRequestStatus, ExeatRequestStatusEnum, UserType, UserTypeEnum
 
-engine = create_engine(env.DB_URL)
+db_url = make_url(env.DB_URL)
+# The pool the driver uses unless told otherwise. Only queue pools take sizing options;
+# aiosqlite, for one, defaults to a NullPool (or a StaticPool for `:memory:`).
+default_pool_class = db_url.get_dialect().get_pool_class(db_url)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if env.DB_NULL_POOL:
+    pool_options = {"poolclass": NullPool}
+elif not issubclass(default_pool_class, QueuePool):
+    pool_options = {}
+else:
+    pool_options = {
+        "pool_size": env.DB_POOL_SIZE,
+        "max_overflow": env.DB_MAX_OVERFLOW,
+        "pool_timeout": env.DB_POOL_TIMEOUT,
+        "pool_recycle": env.DB_POOL_RECYCLE,
+        "pool_use_lifo": env.DB_POOL_USE_LIFO,
+        "pool_pre_ping": True,
+    }
 
-sessionmaker_instance: sessionmaker[Session | Any] = sessionmaker(
+# DB_URL must name an async driver, e.g. `sqlite+aiosqlite` or `postgresql+asyncpg`.
+engine = create_async_engine(db_url, echo=False, **pool_options)
+
+sessionmaker_instance: async_sessionmaker[AsyncSession] = async_sessionmaker(
     bind=engine,
-    class_=Session,
+    class_=AsyncSession,
     autoflush=False,
-    autocommit=False,
     expire_on_commit=False,
 )
 
 
-async def db_dependency() -> sessionmaker[Session]:
-    with sessionmaker_instance() as db:
+async def db_dependency() -> AsyncIterator[AsyncSession]:
+    async with sessionmaker_instance() as db:
         yield db
 
 
-usertypes = (UserType(id=v.value, type_name=v.safe_name) for v in UserTypeEnum)
-statuses = (
-    ExeatRequestStatus(id=v.value, status_name=v.safe_name)
-    for v in ExeatRequestStatusEnum
-)
+# A request-scoped database session, as a route parameter annotation.
+DbDep = Annotated[AsyncSession, Depends(db_dependency)]
+
+
+# Dialect-specific INSERTs supporting ON CONFLICT, keyed by dialect name.
+upsert_inserts = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
 
 
-def init_db():
-    SQLModel.metadata.create_all(engine)
-    with sessionmaker_instance() as db:
-        for instance in (*usertypes, *statuses):
-            db.merge(instance)
-        db.commit()
+async def init_db():
+    insert = upsert_inserts[engine.dialect.name]
+    usertypes = [{"id": v.value, "type_name": v.safe_name} for v in UserTypeEnum]
+    statuses = [
+        {"id": v.value, "status_name": v.safe_name} for v in ExeatRequestStatusEnum
+    ]
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        # One statement per reference table, rather than a SELECT + INSERT per row.
+        for model, rows in ((UserType, usertypes), (ExeatRequestStatus, statuses)):
+            await conn.execute(
+                insert(model).values(rows).on_conflict_do_nothing(index_elements=["id"])
+            )
@@ -1,11 +1,43 @@
-from datetime import datetime
+from datetime import UTC, datetime
 from enum import IntEnum
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from sqlalchemy.sql.functions import now
+from sqlalchemy import DateTime, Index, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from sqlmodel import Field, Relationship, SQLModel
 
 
+def as_utc(dt: datetime) -> datetime:
+    """
+    Make a datetime read from the database timezone-aware. Some backends (e.g. SQLite)
+    return naive datetimes even for timezone-aware columns; all are stored as UTC.
+    """
+    return dt if dt.tzinfo else dt.replace(tzinfo=UTC)
+
+
+class utcnow(FunctionElement):
+    """
+    The database's current UTC time, with sub-second precision on every backend.
+    """
+
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _compile_utcnow(element, compiler, **kw):
+    return "now()"
+
+
+@compiles(utcnow, "sqlite")
+def _compile_utcnow_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP only has whole seconds. `%f` gives milliseconds; padded to
+    # microseconds, the text matches how SQLAlchemy stores (and binds) datetimes, so
+    # listing cursors compare against it correctly.
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
 class UserTypeEnum(IntEnum):
     ADMIN = 1
     STUDENT = 2
@@ -16,19 +48,30 @@ class UserTypeEnum(IntEnum):
     def safe_name(self):
         return self.name.lower()
 
-    @classmethod
-    @property
-    def type_string(cls):
-        _names = ", ".join(
-            f'"{user_type.safe_name}"' for user_type in cls if user_type != cls.ADMIN
-        )
-        return f"Literal[{_names}]"
-
     @classmethod
     def from_safe_name(cls, name):
         return cls[name.upper()]
 
 
+# User type IDs mapped to their safe names, for hot paths that only need the name.
+USER_TYPE_NAMES: dict[int, str] = {
+    user_type.value: user_type.safe_name for user_type in UserTypeEnum
+}
+# And the reverse: safe names mapped to their user types.
+USER_TYPES_BY_NAME: dict[str, UserTypeEnum] = {
+    user_type.safe_name: user_type for user_type in UserTypeEnum
+}
+
+# The safe names of the user types that can sign up, as a `Literal` type.
+UserTypeEnum.type_literal = Literal[
+    tuple(
+        user_type.safe_name
+        for user_type in UserTypeEnum
+        if user_type != UserTypeEnum.ADMIN
+    )
+]
+
+
 class ExeatRequestStatusEnum(IntEnum):
     PENDING = 1
     APPROVED = 2
@@ -38,17 +81,27 @@ class ExeatRequestStatusEnum(IntEnum):
     def safe_name(self):
         return self.name.lower()
 
-    @classmethod
-    @property
-    def type_string(cls):
-        _names = ", ".join(f'"{user_type.safe_name}"' for user_type in cls)
-        return f"Literal[{_names}]"
-
     @classmethod
     def from_safe_name(cls, name):
         return cls[name.upper()]
 
 
+# Exeat request status IDs mapped to their safe names, for hot paths that only need
+# the name.
+EXEAT_REQUEST_STATUS_NAMES: dict[int, str] = {
+    status.value: status.safe_name for status in ExeatRequestStatusEnum
+}
+# And the reverse: safe names mapped to their statuses.
+EXEAT_REQUEST_STATUSES_BY_NAME: dict[str, ExeatRequestStatusEnum] = {
+    status.safe_name: status for status in ExeatRequestStatusEnum
+}
+
+# The safe names of the exeat request statuses, as a `Literal` type.
+ExeatRequestStatusEnum.type_literal = Literal[
+    tuple(status.safe_name for status in ExeatRequestStatusEnum)
+]
+
+
 class UserType(SQLModel, table=True):
     """
     Reference table for the types of users which exist within the system.
@@ -66,11 +119,16 @@ class RevokedToken(SQLModel, table=True):
     """
 
     __tablename__ = "revoked_token"
+    __table_args__ = (
+        # Revocation checks are pure equality lookups on sig, which a hash index
+        # serves with fewer pages than the primary key's B-tree (PostgreSQL only).
+        Index("revoked_token_sig_hash", "sig", postgresql_using="hash"),
+        # Cleanup scans by expiry.
+        Index("revoked_token_exp_idx", "exp"),
+    )
 
-    sig: str = Field(
-        primary_key=True, index=True, unique=True
-    )  # Primary key: Signature of the JWT
-    exp: datetime = Field(..., index=True)  # Store expiration timestamp
+    sig: str = Field(primary_key=True)  # Primary key: Signature of the JWT
+    exp: datetime = Field(sa_type=DateTime(timezone=True))  # Store expiration timestamp
 
 
 class ExeatRequestStatus(SQLModel, table=True):
@@ -103,7 +161,26 @@ class User(SQLModel, table=True):
         foreign_key="user_type.id", index=True
     )  # References user_type table
     profile_picture_id: str | None = None
-    time_joined: datetime = Field(default_factory=now)
+    # Set in Python rather than by the database, so it is known as soon as the user is
+    # created, without reading the row back.
+    time_joined: datetime = Field(
+        default_factory=lambda: datetime.now(UTC), sa_type=DateTime(timezone=True)
+    )
+
+    # Profiles; at most one is set, according to the user type. Each is deleted along
+    # with its user, as its `user_id` can't be left empty.
+    student: Optional["Student"] = Relationship(
+        back_populates="user",
+        sa_relationship_kwargs={"uselist": False, "cascade": "all, delete-orphan"},
+    )
+    staff: Optional["Staff"] = Relationship(
+        back_populates="user",
+        sa_relationship_kwargs={"uselist": False, "cascade": "all, delete-orphan"},
+    )
+    security_operative: Optional["SecurityOperative"] = Relationship(
+        back_populates="user",
+        sa_relationship_kwargs={"uselist": False, "cascade": "all, delete-orphan"},
+    )
 
 
 class Guardian(SQLModel, table=True):
@@ -135,8 +212,11 @@ class Student(SQLModel, table=True):
     guardian_id: int = Field(foreign_key="guardian.id", index=True)
     guardian_relationship: str
 
+    user: "User" = Relationship(back_populates="student")
+    # Deleted along with the student, as their `student_id` can't be left empty.
     requested_exeats: List["ExeatRequest"] = Relationship(
         back_populates="requesting_student",
+        sa_relationship_kwargs={"cascade": "all, delete-orphan"},
     )
     guardian: "Guardian" = Relationship(back_populates="students")
 
@@ -154,6 +234,7 @@ class Staff(SQLModel, table=True):
     staff_id: str = Field(index=True)
     designation: str
 
+    user: "User" = Relationship(back_populates="staff")
     addressed_exeats: List["ExeatRequest"] = Relationship(
         back_populates="reviewing_staff",
     )
@@ -171,6 +252,8 @@ class SecurityOperative(SQLModel, table=True):
     security_id: str = Field(index=True)
     designation: str
 
+    user: "User" = Relationship(back_populates="security_operative")
+
 
 class ExeatRequest(SQLModel, table=True):
     """
@@ -180,16 +263,51 @@ class ExeatRequest(SQLModel, table=True):
     __tablename__ = "exeat_request"
 
     id: int = Field(default=None, primary_key=True)
-    student_id: int = Field(foreign_key="student.id", index=True)
-    leave_start: datetime
-    leave_end: datetime
-    submission_time: datetime = Field(default_factory=now)
+    # Indexed as the leading column of composite indexes, below, as are `status_id` and
+    # `staff_id`.
+    student_id: int = Field(foreign_key="student.id")
+    leave_start: datetime = Field(sa_type=DateTime(timezone=True))
+    leave_end: datetime = Field(sa_type=DateTime(timezone=True))
+    # Stamped by the database's clock, whether or not the table predates the default.
+    submission_time: datetime = Field(
+        default=None,
+        sa_type=DateTime(timezone=True),
+        sa_column_kwargs={"default": utcnow(), "server_default": utcnow()},
+    )
     reason: str
-    status_id: int = Field(foreign_key="exeat_request_status.id", index=True)
-    staff_id: int | None = Field(default=None, foreign_key="staff.id", index=True)
-    staff_review_time: datetime | None = None
+    status_id: int = Field(foreign_key="exeat_request_status.id")
+    staff_id: int | None = Field(default=None, foreign_key="staff.id")
+    staff_review_time: datetime | None = Field(
+        default=None, sa_type=DateTime(timezone=True)
+    )
     staff_comment: str | None = None
 
     # Relationships
     requesting_student: "Student" = Relationship(back_populates="requested_exeats")
     reviewing_staff: "Staff" = Relationship(back_populates="addressed_exeats")
+
+
+# When an exeat request was last updated: its review if it has one, else its submission.
+exeat_last_updated = func.coalesce(
+    ExeatRequest.staff_review_time, ExeatRequest.submission_time
+)
+# Lets listings sorted by `exeat_last_updated` use an index scan instead of a sort.
+Index("ix_exeat_last_updated", exeat_last_updated)
+# And likewise for listings filtered by status.
+Index("ix_exeat_status_updated", ExeatRequest.status_id, exeat_last_updated)
+# And for the staff and student listings: the equality filters lead, and the sort
+# column comes last.
+Index(
+    "ix_exeat_staff_status_updated",
+    ExeatRequest.staff_id,
+    ExeatRequest.status_id,
+    exeat_last_updated,
+)
+Index(
+    "ix_exeat_student_status_updated",
+    ExeatRequest.student_id,
+    ExeatRequest.status_id,
+    exeat_last_updated,
+)
+Index("ix_exeat_staff_leave_start", ExeatRequest.staff_id, ExeatRequest.leave_start)
+Index("ix_exeat_staff_leave_end", ExeatRequest.staff_id, ExeatRequest.leave_end)
@@ -1,36 +1,59 @@
+import hmac
+import re
+from base64 import urlsafe_b64encode
 from datetime import UTC, datetime, timedelta
-from typing import Annotated, Literal, Self  # noqa
-
-from bcrypt import checkpw, gensalt, hashpw
+from hashlib import sha256
+from os import cpu_count
+from time import time
+from typing import Annotated, Self
+
+import bcrypt
+import orjson
+from anyio import CapacityLimiter, to_thread
+from cachetools import TLRUCache, TTLCache
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jwt import PyJWTError, decode, encode
+from jwt import PyJWTError, decode
 from loguru import logger
 from pydantic import (
     BaseModel,
     EmailStr,
     Field,
+    SecretStr,
     ValidationError,
     field_validator,
-    SecretStr,
     model_validator,
 )
 from pydantic_core import PydanticCustomError
 from sqlalchemy.exc import SQLAlchemyError
-from sqlmodel import Session
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from ..constants import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
+    AUTH_CACHE_MAXSIZE,
+    AUTH_CACHE_TTL_SECONDS,
     PROFILE_PICTURE_PATH,
     STATIC_PATH,
     env,
 )
-from ..db import SecurityOperative, Staff, Student, User, UserTypeEnum, db_dependency
+from ..db import (
+    USER_TYPES_BY_NAME,
+    DbDep,
+    SecurityOperative,
+    Staff,
+    Student,
+    User,
+    UserTypeEnum,
+    as_utc,
+)
 from ..db.models import Guardian
 from ..revocation import is_jwt_revoked, revoke_jwt
 
 SECRET_KEY = env.SECRET_KEY
 ALGORITHM = "HS256"
+_EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 error_invalid_credentials = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
     detail="Not authenticated.",
@@ -38,12 +61,35 @@ error_invalid_credentials = HTTPException(
 )
 
 
-def verify_password(plain_password: str, hashed_password: bytes):
-    return checkpw(plain_password.encode("utf-8"), hashed_password)
+# bcrypt is CPU-bound, so it runs in worker threads (it releases the GIL), at most
+# one per core, and separately from the default thread pool used for other work.
+password_hash_limiter = CapacityLimiter(cpu_count() or 1)
+
+
+async def verify_password(plain_password: str, hashed_password: bytes) -> bool:
+    return await to_thread.run_sync(
+        bcrypt.checkpw,
+        plain_password.encode("utf-8"),
+        hashed_password,
+        limiter=password_hash_limiter,
+    )
+
+
+async def get_password_hash(password: str) -> bytes:
+    salt = bcrypt.gensalt(rounds=env.BCRYPT_COST)
+    return await to_thread.run_sync(
+        bcrypt.hashpw, password.encode("utf-8"), salt, limiter=password_hash_limiter
+    )
+
+
+def _b64url(data: bytes) -> bytes:
+    return urlsafe_b64encode(data).rstrip(b"=")
 
 
-def get_password_hash(password: str):
-    return hashpw(password.encode("utf-8"), gensalt())
+# Tokens are signed directly with HMAC-SHA256 (HS256). The header never changes, and
+# the key is processed once; each token copies that state instead of redoing it.
+_HEADER_B64 = _b64url(orjson.dumps({"alg": ALGORITHM, "typ": "JWT"}))
+_SIGNER = hmac.new(SECRET_KEY.encode("utf-8"), digestmod=sha256)
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -53,9 +99,12 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
         expire = iat + expires_delta
     else:
         expire = iat + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire, "iat": iat})
-    encoded_jwt = encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    to_encode.update({"exp": int(expire.timestamp()), "iat": int(iat.timestamp())})
+    signing_input = _HEADER_B64 + b"." + _b64url(orjson.dumps(to_encode))
+    signer = _SIGNER.copy()
+    signer.update(signing_input)
+    encoded_jwt = signing_input + b"." + _b64url(signer.digest())
+    return encoded_jwt.decode("ascii")
 
 
 title = "Authentication"
@@ -67,6 +116,22 @@ PROFILE_UNAUTHORIZED = "User profile type does not have access to this resource.
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# The bearer token of the request, as a route parameter annotation.
+TokenDep = Annotated[str, Depends(oauth2_scheme)]
+
+# Users that recently authenticated, keyed by the signature of their JWT.
+# Spares a revocation check and a user lookup on every request with the same token.
+user_cache: TTLCache[str, User] = TTLCache(
+    maxsize=AUTH_CACHE_MAXSIZE, ttl=AUTH_CACHE_TTL_SECONDS
+)
+
+# Decoded payloads of valid JWTs, keyed by the raw token and kept until the token
+# expires, so the signature is verified once per token rather than once per request.
+decoded_token_cache: TLRUCache[str, "TokenData"] = TLRUCache(
+    maxsize=AUTH_CACHE_MAXSIZE,
+    ttu=lambda _token, token_data, _now: token_data.exp.timestamp(),
+    timer=time,
+)
 
 
 class Token(BaseModel):
@@ -74,6 +139,16 @@ class Token(BaseModel):
     token_type: str
 
 
+class TokenData(BaseModel):
+    """
+    The claims of a decoded JWT. The timestamps are parsed as UTC datetimes.
+    """
+
+    sub: str
+    iat: datetime
+    exp: datetime
+
+
 class UpdateUserInfo(BaseModel):
     first_name: str | None = Field(None, description="The user's first name.")
     last_name: str | None = Field(None, description="The user's last name.")
@@ -87,13 +162,31 @@ class ChangePassword(BaseModel):
     new_password: SecretStr = Field(..., description="The new password to change to.")
 
 
+# The profile fields each user type must provide on signup.
+_REQUIRED_BY_TYPE: dict[str, frozenset[str]] = {
+    UserTypeEnum.STUDENT.safe_name: frozenset(
+        {
+            "matriculation_number",
+            "course_of_study",
+            "guardian_name",
+            "guardian_phone_number",
+            "guardian_relationship",
+        }
+    ),
+    UserTypeEnum.STAFF.safe_name: frozenset({"staff_id", "designation"}),
+    UserTypeEnum.SECURITY_OPERATIVE.safe_name: frozenset(
+        {"security_id", "designation"}
+    ),
+}
+
+
 class UserCreate(BaseModel):
     """
     Schema for creating a new user, including fields for optional profiles
     based on user type (Student, Staff, or SecurityOperative).
     """
 
-    user_type: str = Field(..., description="The user's type.")
+    user_type: UserTypeEnum.type_literal = Field(..., description="The user's type.")
     email: EmailStr = Field(..., description="The user's email address.")
     password: SecretStr = Field(..., description="The password chosen by the user.")
     first_name: str = Field(..., description="The user's first name.")
@@ -140,35 +233,29 @@ class UserCreate(BaseModel):
         description="The ID of the `security_operative`. Mandatory for `security_operatives`",
     )
 
-    def _unset_check(self, fields: set[str]):
+    def _unset_check(self, fields: frozenset[str]):
         unset = fields.difference(self.model_fields_set)
         if unset:
             raise PydanticCustomError(
                 "missing_fields",
                 "Missing some required fields for the {user_type} user_type: {unset}",
-                {"user_type": self.user_type, "unset": ", ".join(unset)}
+                {"user_type": self.user_type, "unset": ", ".join(unset)},
             )
 
     @model_validator(mode="after")
     def validate_based_on_user_type(self) -> Self:
-        match self.user_type:
-            case UserTypeEnum.STUDENT.safe_name:
-                self._unset_check(
-                    {
-                        "matriculation_number",
-                        "course_of_study",
-                        "guardian_name",
-                        "guardian_phone_number",
-                        "guardian_relationship",
-                    }
-                )
-            case UserTypeEnum.STAFF.safe_name:
-                self._unset_check({"staff_id", "designation"})
-            case UserTypeEnum.SECURITY_OPERATIVE.safe_name:
-                self._unset_check({"security_id", "designation"})
+        required = _REQUIRED_BY_TYPE.get(self.user_type)
+        if required:
+            self._unset_check(required)
         return self
 
 
+# The URL path under which profile pictures are served.
+_PROFILE_URL_PREFIX = (
+    f"{STATIC_PATH.stem}/{PROFILE_PICTURE_PATH.relative_to(STATIC_PATH).as_posix()}/"
+)
+
+
 class UserResponse(BaseModel):
     """
     Schema for the response after creating or retrieving a user,
@@ -182,110 +269,123 @@ class UserResponse(BaseModel):
     is_active: bool
     is_verified: bool
     profile_picture: str | None = Field(validation_alias="profile_picture_id")
-    time_joined: datetime = datetime.now(UTC)
+    time_joined: datetime
 
     @field_validator("profile_picture")
     def set_profile_picture(cls, value):
         if value:
-            value = (
-                STATIC_PATH.stem
-                + "/"
-                + str(
-                    (PROFILE_PICTURE_PATH / value).relative_to(STATIC_PATH).as_posix()
-                )
-                + ".webp"
-            )
+            value = f"{_PROFILE_URL_PREFIX}{value}.webp"
         return value
 
 
-class Email(BaseModel):
-    email: EmailStr
+# Async, though it does no I/O: FastAPI would run a sync dependency in its threadpool,
+# where unsynchronized access to the (not thread-safe) cache could corrupt it.
+async def decoded_token(
+    token: TokenDep,
+) -> TokenData:
+    token_data = decoded_token_cache.get(token)
+    if token_data is None:
+        try:
+            token_data = TokenData.model_validate(
+                decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            )
+        except (PyJWTError, ValidationError):
+            raise error_invalid_credentials
+        # Invalid tokens raise above and are never cached.
+        decoded_token_cache[token] = token_data
+    return token_data
 
 
-class MatriculationNumber(BaseModel):
-    matriculation_number: str = Field(pattern=r"^\d{4}/\d{4,5}$")
+# The claims of the request's bearer token, as a route parameter annotation.
+PayloadDep = Annotated[TokenData, Depends(decoded_token)]
 
 
-def decoded_token(
-    token: Annotated[str, Depends(oauth2_scheme)],
-):
-    try:
-        return decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except PyJWTError:
-        raise error_invalid_credentials
+def forget_cached_user(token: str):
+    """
+    Drop the cached user for a token, e.g. after the user or the token changes.
+    """
+    user_cache.pop(token.rsplit(".", 1)[1], None)
 
 
-def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)],
-    token_payload: Annotated[dict[str, ...], Depends(decoded_token)],
-    db: Annotated[Session, Depends(db_dependency)],
+async def get_current_user(
+    token: TokenDep,
+    token_data: PayloadDep,
+    db: DbDep,
 ):
-    if is_jwt_revoked(db, token):
-        raise error_invalid_credentials
-    email: str = token_payload.get("sub")
-    iat: datetime = datetime.fromtimestamp(token_payload.get("iat"))
-    if email is None:
-        raise error_invalid_credentials
-    # noinspection PyTypeChecker,Pydantic
-    user: User | None = db.query(User).where(User.email == email).first()
+    sig = token.rsplit(".", 1)[1]
+    user: User | None = user_cache.get(sig)
     if user is None:
-        raise error_invalid_credentials
-    if user.time_joined > iat:
-        raise error_invalid_credentials
-    return user
+        if is_jwt_revoked(token):
+            raise error_invalid_credentials
+        # The profiles are loaded along with the user, so the profile dependencies
+        # below need no queries of their own.
+        # noinspection PyTypeChecker,Pydantic
+        user = await db.scalar(
+            select(User)
+            .options(
+                selectinload(User.student),
+                selectinload(User.staff),
+                selectinload(User.security_operative),
+            )
+            .where(User.email == token_data.sub)
+        )
+        if user is None:
+            raise error_invalid_credentials
+        # Tokens issued before the account was created belong to a former account
+        # with the same email. `iat` only has whole seconds, so compare at that grain.
+        if as_utc(user.time_joined).replace(microsecond=0) > token_data.iat:
+            raise error_invalid_credentials
+        # Only a detached snapshot is cached, so no request can mutate the cached copy.
+        db.expunge(user)
+        user_cache[sig] = user
+    # Attach a copy of the user to this request's session without querying for it.
+    return await db.merge(user, load=False)
 
 
-def get_current_student(
-    db: Annotated[Session, Depends(db_dependency)],
-    user: Annotated[User, Depends(get_current_user)],
+# The authenticated user, as a route parameter annotation.
+CurrentUserDep = Annotated[User, Depends(get_current_user)]
+
+
+async def get_current_student(
+    user: CurrentUserDep,
 ) -> Student:
     """
     Dependency that verifies the current user is a Student.
     """
-    # noinspection PyTypeChecker,Pydantic
-    student = db.query(Student).where(Student.user_id == user.id).first()
-    if not student:
+    if not user.student:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail=PROFILE_UNAUTHORIZED
         )
-    return student
+    return user.student
 
 
-def get_current_staff(
-    db: Annotated[Session, Depends(db_dependency)],
-    user: Annotated[User, Depends(get_current_user)],
+async def get_current_staff(
+    user: CurrentUserDep,
 ) -> Staff:
     """
     Dependency that verifies the current user is a Staff member.
     """
-    # noinspection PyTypeChecker,Pydantic
-    staff = db.query(Staff).where(Staff.user_id == user.id).first()
-    if not staff:
+    if not user.staff:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail=PROFILE_UNAUTHORIZED
         )
-    return staff
+    return user.staff
 
 
-def get_current_security_operative(
-    db: Annotated[Session, Depends(db_dependency)],
-    user: Annotated[User, Depends(get_current_user)],
+async def get_current_security_operative(
+    user: CurrentUserDep,
 ) -> SecurityOperative:
     """
     Dependency that verifies the current user is a Security Operative.
     """
-    # noinspection PyTypeChecker,Pydantic
-    security_operative = (
-        db.query(SecurityOperative).where(SecurityOperative.user_id == user.id).first()
-    )
-    if not security_operative:
+    if not user.security_operative:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail=PROFILE_UNAUTHORIZED
         )
-    return security_operative
+    return user.security_operative
 
 
-def authenticate_user(db: Session, email: str, password: str) -> User | None:
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> User | None:
     """
     Authenticate a user using either their email.
 
@@ -295,29 +395,27 @@ def authenticate_user(db: Session, email: str, password: str) -> User | None:
     :return: User object if authentication is successful, otherwise None.
     """
     logger.info('Authenticating user with email "{}"', email)
-    try:
-        # noinspection PyTypeChecker
-        Email(email=email)
-    except ValidationError:
+    # A cheap shape check; anything stored was fully validated as an email at signup.
+    if not _EMAIL_PATTERN.match(email):
         return None
     # noinspection PyTypeChecker,Pydantic
-    user = db.query(User).where(User.email == email).first()
-    if not user or not verify_password(password, user.hashed_password):
+    user = await db.scalar(select(User).where(User.email == email))
+    if not user or not await verify_password(password, user.hashed_password):
         return None
     return user
 
 
 @router.post("/token", response_model=Token)
-def login(
+async def login(
     form: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Annotated[Session, Depends(db_dependency)],
+    db: DbDep,
 ):
     """
     Login a user to get an access token.
 
     The username is the user's email address.
     """
-    user = authenticate_user(db, form.username, form.password)
+    user = await authenticate_user(db, form.username, form.password)
     if not user:
         logger.warning('Invalid login attempt for username "{}"', form.username)
         raise HTTPException(
@@ -326,7 +424,7 @@ def login(
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token = create_access_token({"sub": user.email})
-    logger.info(f"User {user.email} logged in successfully")
+    logger.info("User {} logged in successfully", user.email)
     return {
         "access_token": access_token,
         "token_type": "bearer",
@@ -336,21 +434,24 @@ def login(
 
 @router.post("/revoke", status_code=status.HTTP_204_NO_CONTENT)
 async def logout(
-    db: Annotated[Session, Depends(db_dependency)],
-    token: Annotated[str, Depends(oauth2_scheme)],
-    token_payload: Annotated[dict[str, ...], Depends(decoded_token)],
+    db: DbDep,
+    token: TokenDep,
+    token_data: PayloadDep,
 ):
     """
     Logout a user by revoking the access token supplied.
     """
-    revoke_jwt(db, jwt=token, exp=token_payload["exp"])
+    await revoke_jwt(db, jwt=token, exp=token_data.exp)
+    # Only once the token is listed as revoked: a request re-caching the user while
+    # the revocation is written would otherwise keep the token usable.
+    forget_cached_user(token)
     logger.info("User logged out")
 
 
 @router.post("/signup")
 async def signup(
     user_data: UserCreate,
-    db: Annotated[Session, Depends(db_dependency)],
+    db: DbDep,
 ):
     """
     Creates a new user and an associated profile based on user type.
@@ -358,8 +459,8 @@ async def signup(
 
     # Check user type and ensure it exists in UserTypeEnum
     try:
-        user_type = UserTypeEnum.from_safe_name(user_data.user_type)
-    except ValueError:
+        user_type = USER_TYPES_BY_NAME[user_data.user_type]
+    except KeyError:
         logger.error("Unsupported user type during profile creation.")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -367,7 +468,9 @@ async def signup(
         )
 
     # Hash the password before saving
-    hashed_password: bytes = get_password_hash(user_data.password.get_secret_value())
+    hashed_password: bytes = await get_password_hash(
+        user_data.password.get_secret_value()
+    )
 
     # Create the basic User entry
     user = User(
@@ -380,10 +483,11 @@ async def signup(
         is_verified=user_data.is_verified,
         phone_number=user_data.phone_number,
     )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    # Everything is written in one transaction: flushes assign the primary keys the
+    # profile needs, and a failure anywhere rolls back the user along with it.
     try:
+        db.add(user)
+        await db.flush()
         # Determine and create the appropriate profile
         match user_type:
             case UserTypeEnum.STUDENT:
@@ -391,8 +495,8 @@ async def signup(
                     name=user_data.guardian_name,
                     phone_number=user_data.guardian_phone_number,
                 )
-                guardian = db.merge(guardian)
-                db.commit()
+                db.add(guardian)
+                await db.flush()
                 profile = Student(
                     user_id=user.id,
                     matriculation_number=user_data.matriculation_number,
@@ -413,32 +517,31 @@ async def signup(
                     designation=user_data.designation,
                 )
             case _:
-                db.delete(user)
-                db.commit()
+                await db.rollback()
                 logger.error("Unsupported user type during profile creation.")
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Unsupported user type for profile creation.",
                 )
+        # Add profile to the database
+        db.add(profile)
+        await db.commit()
     except SQLAlchemyError:
-        db.delete(user)
-        db.commit()
+        await db.rollback()
         logger.error("Error during profile creation.")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Error during profile creation.",
         )
-    # Add profile to the database
-    db.add(profile)
-    db.commit()
-    db.refresh(profile)
     logger.info(
-        f"Created new user with ID {user.id} and profile type {profile.__class__.__name__}."
+        "Created new user with ID {} and profile type {}.",
+        user.id,
+        profile.__class__.__name__,
     )
 
     # Log the user in
     access_token = create_access_token({"sub": user.email})
-    logger.info(f"User {user.email} logged in successfully")
+    logger.info("User {} logged in successfully", user.email)
     return {
         "access_token": access_token,
         "token_type": "bearer",
@@ -451,5 +554,6 @@ async def signup(
             is_active=user.is_active,
             is_verified=user.is_verified,
             profile_picture_id=user.profile_picture_id,
+            time_joined=user.time_joined,
         ),
     }
@@ -1,29 +1,93 @@
-from collections.abc import Iterable
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections.abc import AsyncIterator, Hashable, Mapping, Sequence
 from datetime import datetime
-from typing import Literal
+from hashlib import sha256
+from typing import Annotated, Any, Literal
 
-from fastapi import HTTPException
+from cachetools import TTLCache
+from fastapi import HTTPException, Path, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from loguru import logger
+from orjson import dumps, loads
 from pydantic import BaseModel, Field, model_validator
-from sqlmodel import Session, asc, desc, func, or_, select
-from sqlmodel.sql.expression import Select
+from sqlalchemy import ColumnElement, Select, tuple_, union_all
+from sqlalchemy.orm import aliased
+from sqlmodel import asc, desc, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette import status
 
-from ..db import ExeatRequest, ExeatRequestStatusEnum
+from ..constants import (
+    EXEAT_LISTING_CACHE_MAXSIZE,
+    EXEAT_LISTING_CACHE_TTL_SECONDS,
+    EXEAT_STREAM_BATCH_SIZE,
+)
+from ..db import (
+    EXEAT_REQUEST_STATUS_NAMES,
+    ExeatRequest,
+    ExeatRequestStatusEnum,
+    as_utc,
+    exeat_last_updated,
+    sessionmaker_instance,
+)
 
 error_exeat_request_not_found = HTTPException(
     status_code=status.HTTP_404_NOT_FOUND, detail="Exeat request not found"
 )
+error_invalid_cursor = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+)
+
+# The largest ID an integer primary key can hold.
+MAX_EXEAT_ID = 2**31 - 1
+# Route parameters are bounded so that malformed values are rejected before any query.
+ExeatIdPath = Annotated[int, Path(ge=1, le=MAX_EXEAT_ID)]
+StaffCommentQuery = Annotated[
+    str | None, Query(max_length=255, description="An optional comment on the review")
+]
+
+# Recently served exeat listings, keyed by the `cache_key` and paging parameters of
+# `paginated_exeats_query`. Listings are polled repeatedly, but change rarely.
+exeat_listing_cache: TTLCache[Hashable, "PaginatedExeatsResponse"] = TTLCache(
+    maxsize=EXEAT_LISTING_CACHE_MAXSIZE, ttl=EXEAT_LISTING_CACHE_TTL_SECONDS
+)
+
+
+def model_response(model: BaseModel, status_code: int = status.HTTP_200_OK) -> Response:
+    """
+    Serialize an already-validated model straight to JSON. Returning a `Response`
+    skips FastAPI's re-validation of the result against the route's response model.
+    """
+    return Response(
+        model.model_dump_json(), status_code=status_code, media_type="application/json"
+    )
+
+
+def etag_response(
+    request: Request, content: Any, cache_control: str = "private, no-cache"
+) -> Response:
+    """
+    Serialize `content` as JSON with an ETag derived from the body, answering with
+    `304 Not Modified` (and no body) when the client already holds that version.
+    """
+    response = ORJSONResponse(jsonable_encoder(content))
+    etag = f'"{sha256(response.body).hexdigest()[:16]}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return response
 
 
 class ExeatRequestResponse(BaseModel):
     id: int
+    student_id: int
+    staff_id: int | None = None  # The reviewing staff member, if assigned
     leave_start: datetime
     leave_end: datetime
     submission_time: datetime
     reason: str
-    status: str = (
-        ExeatRequestStatusEnum.PENDING.safe_name
-    )
+    status: str = ExeatRequestStatusEnum.PENDING.safe_name
     staff_comment: str | None = None
     staff_date: datetime | None = (
         None  # Date the request was approved or denied, if applicable
@@ -32,25 +96,51 @@ class ExeatRequestResponse(BaseModel):
     @model_validator(mode="before")
     def validate_status(cls, values: dict[str, ...] | ExeatRequest):
         if isinstance(values, ExeatRequest):
-            values = values.model_dump()
-            values["status"] = ExeatRequestStatusEnum(values["status_id"]).safe_name
+            # Read only the needed attributes, rather than dumping the whole row.
+            values = {
+                "id": values.id,
+                "student_id": values.student_id,
+                "staff_id": values.staff_id,
+                "leave_start": values.leave_start,
+                "leave_end": values.leave_end,
+                "submission_time": values.submission_time,
+                "reason": values.reason,
+                "status": EXEAT_REQUEST_STATUS_NAMES[values.status_id],
+                "staff_comment": values.staff_comment,
+                "staff_date": values.staff_review_time,
+            }
         elif isinstance(values, dict):
             status_id = values.pop("status_id", None)
             if status_id is not None:
-                values["status"] = ExeatRequestStatusEnum(status_id).safe_name
+                values["status"] = EXEAT_REQUEST_STATUS_NAMES[status_id]
         return values
 
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any]) -> "ExeatRequestResponse":
+        """
+        Build a response from a row of `EXEAT_RESPONSE_COLUMNS`. The values come
+        straight from the database, so validation is skipped.
+        """
+        values = {name: row[name] for name in cls.model_fields if name != "status"}
+        values["status"] = EXEAT_REQUEST_STATUS_NAMES[row["status_id"]]
+        return cls.model_construct(**values)
+
 
 class PaginatedExeatsResponse(BaseModel):
     total_items: int = Field(examples=[109])
     total_pages: int = Field(examples=[11])
     page_size: int = Field(examples=[2])
-    current_page: int = Field(examples=[1])
-    items: Iterable[ExeatRequestResponse] = Field(
+    next_cursor: str | None = Field(
+        description="Pass as `cursor` to fetch the next page. `null` on the last page.",
+        examples=["WyIyMDIzLTA4LTExVDAwOjAwOjAwIiw4Ml0"],
+    )
+    items: list[ExeatRequestResponse] = Field(
         examples=[
             [
                 ExeatRequestResponse(
                     id=23,
+                    student_id=4,
+                    staff_id=2,
                     leave_start=datetime(2023, 6, 14),
                     leave_end=datetime(2023, 7, 2),
                     submission_time=datetime(2023, 1, 1),
@@ -61,6 +151,8 @@ class PaginatedExeatsResponse(BaseModel):
                 ),
                 ExeatRequestResponse(
                     id=82,
+                    student_id=4,
+                    staff_id=2,
                     leave_start=datetime(2023, 8, 12),
                     leave_end=datetime(2023, 8, 15),
                     submission_time=datetime(2023, 8, 11),
@@ -74,54 +166,257 @@ class PaginatedExeatsResponse(BaseModel):
     )
 
 
-def paginated_exeats_query(
-    db: Session,
-    query: Select[ExeatRequest] = select(ExeatRequest),
-    page: int = 1,
-    page_size: int = 20,
-    status_id: ExeatRequestStatusEnum | None = None,
-    sort: Literal["last_updated", "leave_start", "leave_end"] = "last_updated",
+def exeat_response_columns(exeats: type[ExeatRequest]) -> tuple[ColumnElement, ...]:
+    """
+    The columns an `ExeatRequestResponse` is built from, named after its fields, of
+    `ExeatRequest` or an alias of it.
+    """
+    # noinspection PyTypeChecker,Pydantic
+    return (
+        exeats.id,
+        exeats.student_id,
+        exeats.staff_id,
+        exeats.leave_start,
+        exeats.leave_end,
+        exeats.submission_time,
+        exeats.reason,
+        exeats.status_id,
+        exeats.staff_comment,
+        exeats.staff_review_time.label("staff_date"),
+    )
+
+
+EXEAT_RESPONSE_COLUMNS = exeat_response_columns(ExeatRequest)
+
+
+# The attributes exeat listings can be sorted by, and the columns they sort on.
+ExeatSort = Literal["last_updated", "leave_start", "leave_end"]
+# noinspection PyTypeChecker,Pydantic
+SORT_COLUMNS: dict[ExeatSort, ColumnElement] = {
+    "last_updated": exeat_last_updated,
+    "leave_start": ExeatRequest.leave_start,
+    "leave_end": ExeatRequest.leave_end,
+}
+
+
+async def exeat_etag_response(
+    request: Request,
+    db: AsyncSession,
+    exeat_id: int,
+    *criteria: ColumnElement[bool],
+) -> Response:
+    """
+    Fetch an exeat request by ID, if it meets any further criteria (e.g. being visible
+    to the user), with a weak ETag derived from its ID, review and last update time.
+    Clients already holding that version get an empty `304 Not Modified`, sparing the
+    response's serialization.
+    """
+    # noinspection PyTypeChecker,Pydantic
+    query = select(
+        *EXEAT_RESPONSE_COLUMNS, exeat_last_updated.label("last_updated")
+    ).where(ExeatRequest.id == exeat_id, *criteria)
+    row = (await db.exec(query)).first()
+    if row is None:
+        logger.error("Exeat request with ID {} not found", exeat_id)
+        raise error_exeat_request_not_found
+    # The review itself is part of the tag, so a review can't go unnoticed even if the
+    # timestamps collide (e.g. on a backend storing whole seconds).
+    last_updated = int(as_utc(row.last_updated).timestamp() * 1_000_000)
+    etag = f'W/"{row.id}-{row.status_id}-{row.staff_id}-{last_updated}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response = model_response(ExeatRequestResponse.from_row(row._mapping))
+    response.headers.update(headers)
+    return response
+
+
+def encode_cursor(sort_value: datetime, exeat_id: int) -> str:
+    """
+    Encode the position of an exeat request within a sorted listing as a cursor.
+    """
+    return urlsafe_b64encode(dumps([sort_value, exeat_id])).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    padding = "=" * (-len(cursor) % 4)
+    try:
+        sort_value, exeat_id = loads(urlsafe_b64decode(cursor + padding))
+        return datetime.fromisoformat(sort_value), int(exeat_id)
+    except (ValueError, TypeError):
+        raise error_invalid_cursor
+
+
+def exeat_listing_query(
+    *criteria: ColumnElement[bool],
+    any_of: Sequence[ColumnElement[bool]] = (),
+    sort: ExeatSort = "last_updated",
     ascending: bool = False,
-) -> PaginatedExeatsResponse:
-    # Filter by status
-    if status_id:
-        # noinspection Pydantic
-        query = query.where(ExeatRequest.status_id == status_id)
+    cursor: str | None = None,
+    limit: int | None = None,
+) -> Select:
+    """
+    Select the response columns of the exeat requests matching the criteria, sorted,
+    starting after the cursor, with their sort value (as `sort_value`) for building the
+    next one.
 
-    # Sort
+    `any_of` takes mutually exclusive conditions, one of which must also match. Each is
+    queried separately, so each can use its own index; only their results are merged.
+    """
+    sort_column = SORT_COLUMNS[sort]
     sort_func = asc if ascending else desc
-    match sort:
-        case "last_updated":
-            # noinspection Pydantic,PyTypeChecker
-            query = query.order_by(
-                sort_func(
-                    or_(ExeatRequest.staff_review_time, ExeatRequest.submission_time)
-                )
+    position = tuple_(*decode_cursor(cursor)) if cursor else None
+
+    def page(query: Select, sort_value: ColumnElement, exeat_id: ColumnElement):
+        # Seek past the previous page, rather than scanning and skipping over it.
+        # The ID breaks ties between equal sort values.
+        if position is not None:
+            key = tuple_(sort_value, exeat_id)
+            query = query.where(key > position if ascending else key < position)
+        query = query.order_by(sort_func(sort_value), sort_func(exeat_id))
+        return query if limit is None else query.limit(limit)
+
+    # noinspection PyTypeChecker,Pydantic
+    if not any_of:
+        return page(
+            select(*EXEAT_RESPONSE_COLUMNS, sort_column.label("sort_value")).where(
+                *criteria
+            ),
+            sort_column,
+            ExeatRequest.id,
+        )
+
+    # Each branch is sorted and cut to a page by itself, so the merged page is taken
+    # from at most a page per branch. (SQLite doesn't allow ORDER BY or LIMIT within a
+    # UNION's members, hence each branch being wrapped in a subquery.)
+    # noinspection PyTypeChecker,Pydantic
+    branches = union_all(
+        *(
+            select(
+                page(
+                    select(ExeatRequest, sort_column.label("sort_value")).where(
+                        condition, *criteria
+                    ),
+                    sort_column,
+                    ExeatRequest.id,
+                ).subquery()
             )
-        case "leave_start":
-            # noinspection Pydantic
-            query = query.order_by(sort_func(ExeatRequest.leave_start))
-        case "leave_end":
-            # noinspection Pydantic
-            query = query.order_by(sort_func(ExeatRequest.leave_end))
+            for condition in any_of
+        )
+    ).subquery()
+    exeats = aliased(ExeatRequest, branches)
+    query = select(*exeat_response_columns(exeats), branches.c.sort_value)
+    query = query.order_by(sort_func(branches.c.sort_value), sort_func(exeats.id))
+    return query if limit is None else query.limit(limit)
+
+
+def exeat_count_query(
+    *criteria: ColumnElement[bool], any_of: Sequence[ColumnElement[bool]] = ()
+) -> Select:
+    """
+    Count the exeat requests matching the criteria, and any one of the `any_of`
+    conditions, if given (see `exeat_listing_query`).
+    """
+    # noinspection PyTypeChecker,Pydantic
+    if not any_of:
+        return select(func.count(ExeatRequest.id)).where(*criteria)
+    # noinspection PyTypeChecker,Pydantic
+    branches = union_all(
+        *(select(ExeatRequest.id).where(condition, *criteria) for condition in any_of)
+    ).subquery()
+    return select(func.count()).select_from(branches)
+
+
+def forget_cached_exeat_listings():
+    """
+    Drop every cached exeat listing, e.g. after an exeat request is created or changed.
+    A single write can show up in the listings of many users, so all are dropped.
+    """
+    exeat_listing_cache.clear()
 
-    # Get the total count of exeats for the query.
-    total_items: int = db.scalar(func.count(query.c.id))
 
-    # Pagination calculations.
+async def paginated_exeats_query(
+    db: AsyncSession,
+    *criteria: ColumnElement[bool],
+    any_of: Sequence[ColumnElement[bool]] = (),
+    cache_key: Hashable | None = None,
+    page_size: int = 20,
+    cursor: str | None = None,
+    sort: ExeatSort = "last_updated",
+    ascending: bool = False,
+) -> PaginatedExeatsResponse:
+    # `cache_key` must identify the criteria (e.g. the role and user they're scoped to,
+    # and any status filter).
+    if cache_key is not None:
+        cache_key = (cache_key, page_size, cursor, sort, ascending)
+        cached = exeat_listing_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # The total count of exeats matching the filters, as a scalar subquery. It is
+    # uncorrelated, so it counts every match, not just those past the cursor (which a
+    # window count over the page query would).
+    count_query = exeat_count_query(*criteria, any_of=any_of).correlate(None)
+
+    # Only the columns the response needs are selected, and the total comes alongside,
+    # so one round trip fetches both. One extra row tells whether there is a next page.
+    query = exeat_listing_query(
+        *criteria,
+        any_of=any_of,
+        sort=sort,
+        ascending=ascending,
+        cursor=cursor,
+        limit=page_size + 1,
+    ).add_columns(count_query.scalar_subquery().label("total_items"))
+    rows = (await db.exec(query)).all()
+    if rows:
+        total_items: int = rows[0].total_items
+    elif cursor:
+        # Past the last page, there are no rows to read the total from.
+        total_items: int = await db.scalar(count_query)
+    else:
+        total_items: int = 0
     total_pages: int = int((total_items + page_size - 1) // page_size)
-    page: int = min(page, total_pages)
-    start: int = (page - 1) * page_size
 
-    # Apply pagination to the query
-    items: Iterable[dict] = (
-        value for value in db.exec(query.offset(start).limit(page_size)).all()
-    )
+    next_cursor: str | None = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1].sort_value, rows[-1].id)
 
-    return PaginatedExeatsResponse(
+    # Everything here is either computed or read from the database; nothing needs
+    # validating.
+    response = PaginatedExeatsResponse.model_construct(
         total_items=total_items,
         total_pages=total_pages,
-        current_page=page,
         page_size=page_size,
-        items=items,
+        next_cursor=next_cursor,
+        items=[ExeatRequestResponse.from_row(row._mapping) for row in rows],
     )
+    if cache_key is not None:
+        exeat_listing_cache[cache_key] = response
+    return response
+
+
+def stream_exeat_listing(
+    *criteria: ColumnElement[bool],
+    any_of: Sequence[ColumnElement[bool]] = (),
+    sort: ExeatSort = "last_updated",
+    ascending: bool = False,
+) -> StreamingResponse:
+    """
+    Stream every exeat request matching the criteria as newline-delimited JSON, one
+    `ExeatRequestResponse` per line, fetching rows in batches as they are sent.
+    """
+    query = exeat_listing_query(
+        *criteria, any_of=any_of, sort=sort, ascending=ascending
+    ).execution_options(yield_per=EXEAT_STREAM_BATCH_SIZE)
+
+    async def lines() -> AsyncIterator[str]:
+        # The request's session is closed once the handler returns, before the body
+        # is sent, so the stream needs a session of its own.
+        async with sessionmaker_instance() as db:
+            async for row in await db.stream(query):
+                item = ExeatRequestResponse.from_row(row._mapping)
+                yield item.model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -1,24 +1,18 @@
-from typing import Annotated, Literal
+from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Request
 from fastapi.params import Query
 from loguru import logger
-from sqlalchemy.exc import NoResultFound
-from sqlmodel import Session, select
-from sqlmodel.sql.expression import Select
 
-from ..db import (
-    ExeatRequest,
-    ExeatRequestStatusEnum,
-    SecurityOperative,
-    db_dependency,
-    get_exeat_request,
-)
+from ..db import DbDep, ExeatRequest, ExeatRequestStatusEnum, SecurityOperative
 from .auth import get_current_security_operative
 from .common import (
+    ExeatIdPath,
     ExeatRequestResponse,
+    ExeatSort,
     PaginatedExeatsResponse,
-    error_exeat_request_not_found,
+    exeat_etag_response,
+    model_response,
     paginated_exeats_query,
 )
 
@@ -26,24 +20,23 @@ title = "Security Operative"
 router = APIRouter(
     prefix="/security",
     tags=[title],
-    dependencies=[Depends(get_current_security_operative)],
     responses={404: {"description": "Not found"}},
 )
 
 
 @router.get("/exeat", response_model=PaginatedExeatsResponse)
 async def get_exeats(
-    db: Annotated[Session, Depends(db_dependency)],
+    db: DbDep,
     security_operative: Annotated[
         SecurityOperative, Depends(get_current_security_operative)
     ],
-    page: Annotated[
-        int,
+    cursor: Annotated[
+        str | None,
         Query(
-            ge=1,
-            description="The page number to fetch. If the provided value exceeds the possible number of pages, the last page will be returned",
+            description="The `next_cursor` of the previous page, to fetch the page after it. "
+            "Omit to fetch the first page.",
         ),
-    ] = 1,  # Page number, default to 1
+    ] = None,
     page_size: Annotated[
         int,
         Query(
@@ -54,7 +47,7 @@ async def get_exeats(
         ),
     ] = 20,  # Page size, default to 20, max 100
     sort: Annotated[
-        Literal["last_updated", "leave_start", "leave_end"],
+        ExeatSort,
         Query(
             description="The attribute to sort by. May be one of `last_updated` (default), `leave_start` or `leave_end`."
         ),
@@ -65,29 +58,35 @@ async def get_exeats(
             description="Whether or not to sort in ascending order. Defaults to `False` (descending order)."
         ),
     ] = False,
-) -> PaginatedExeatsResponse:
+):
     """
     Retrieve all approved exeat requests. Only accessible to security operatives.
     Only approved requests are visible, by Least Responsibility Principle.
     """
     logger.info(
-        f"Fetching approved exeat requests for security operative ID {security_operative.id}"
+        "Fetching approved exeat requests for security operative ID {}",
+        security_operative.id,
     )
-    return paginated_exeats_query(
-        db,
-        page=page,
-        page_size=page_size,
-        status_id=ExeatRequestStatusEnum.APPROVED,
-        sort=sort,
-        ascending=ascending,
+    return model_response(
+        await paginated_exeats_query(
+            db,
+            # noinspection PyTypeChecker,Pydantic
+            ExeatRequest.status_id == ExeatRequestStatusEnum.APPROVED,
+            cache_key="security",
+            page_size=page_size,
+            cursor=cursor,
+            sort=sort,
+            ascending=ascending,
+        )
     )
 
 
 # noinspection PyUnusedLocal
 @router.get("/exeat/{exeat_id}", response_model=ExeatRequestResponse)
 async def get_exeat(
-    db: Annotated[Session, Depends(db_dependency)],
-    exeat_id: int,
+    request: Request,
+    db: DbDep,
+    exeat_id: ExeatIdPath,
     security_operative: Annotated[
         SecurityOperative, Depends(get_current_security_operative)
     ],
@@ -97,12 +96,4 @@ async def get_exeat(
     """
     # This is the most permissive variant of this endpoint, as security operatives
     #  must be able to view all exeat requests.
-    # noinspection PyTypeChecker,Pydantic
-    query: Select[ExeatRequest] = select(ExeatRequest).where(
-        ExeatRequest.id == exeat_id
-    )
-    try:
-        return db.exec(query).one()
-    except NoResultFound:
-        logger.error("Exeat request with ID {} not found", exeat_id)
-        raise error_exeat_request_not_found
+    return await exeat_etag_response(request, db, exeat_id)
@@ -1,44 +1,79 @@
-from datetime import UTC, datetime
-from typing import Annotated, Literal
+from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from loguru import logger
-from sqlalchemy.exc import NoResultFound
-from sqlmodel import Session, or_, select
-from sqlmodel.sql.expression import Select
+from pydantic import BaseModel, Field
+from sqlalchemy import ColumnElement
+from sqlmodel import or_, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from ..db import (
+    EXEAT_REQUEST_STATUSES_BY_NAME,
+    DbDep,
     ExeatRequest,
     ExeatRequestStatusEnum,
     Staff,
-    db_dependency,
-    get_exeat_request,
+    utcnow,
 )
 from .auth import get_current_staff
 from .common import (
+    MAX_EXEAT_ID,
+    ExeatIdPath,
     ExeatRequestResponse,
+    ExeatSort,
     PaginatedExeatsResponse,
+    StaffCommentQuery,
     error_exeat_request_not_found,
+    exeat_etag_response,
+    forget_cached_exeat_listings,
+    model_response,
     paginated_exeats_query,
+    stream_exeat_listing,
 )
 
 title = "Staff"
-router = APIRouter(
-    prefix="/staff", tags=[title], dependencies=[Depends(get_current_staff)]
-)
+# Every route declares `get_current_staff` itself, as each needs the staff member.
+router = APIRouter(prefix="/staff", tags=[title])
+
+
+class BatchReview(BaseModel):
+    ids: list[Annotated[int, Field(ge=1, le=MAX_EXEAT_ID)]] = Field(
+        ..., min_length=1, max_length=100, description="The exeat requests to review"
+    )
+    comment: str | None = Field(None, max_length=255)
+
+
+class BatchReviewResponse(BaseModel):
+    reviewed: list[ExeatRequestResponse]
+    not_found: list[int] = Field(description="Requested IDs that don't exist")
+    not_pending: list[int] = Field(description="Requested IDs already reviewed")
+
+
+def concerning_staff(staff_id: int) -> tuple[ColumnElement[bool], ...]:
+    """
+    The mutually exclusive cases of an exeat request concerning a staff member (i.e.
+    all pending, and those they reviewed), for a listing's `any_of`.
+
+    Listings query each case separately and combine them with UNION ALL, so that both
+    can use the `staff_id` indexes; a single OR across them tends to make for a full
+    scan.
+    """
+    # noinspection PyTypeChecker,Pydantic
+    return ExeatRequest.staff_id == staff_id, ExeatRequest.staff_id.is_(None)
 
 
 @router.get("/exeat", response_model=PaginatedExeatsResponse)
 async def get_exeats(
-    db: Annotated[Session, Depends(db_dependency)],
+    db: DbDep,
     staff: Annotated[Staff, Depends(get_current_staff)],
-    page: Annotated[
-        int,
+    cursor: Annotated[
+        str | None,
         Query(
-            ge=1,
-            description="The page number to fetch. If the provided value exceeds the possible number of pages, the last page will be returned",
+            description="The `next_cursor` of the previous page, to fetch the page after it. "
+            "Omit to fetch the first page.",
         ),
-    ] = 1,  # Page number, default to 1
+    ] = None,
     page_size: Annotated[
         int,
         Query(
@@ -49,14 +84,14 @@ async def get_exeats(
         ),
     ] = 20,  # Page size, default to 20, max 100
     _status: Annotated[
-        str,
+        ExeatRequestStatusEnum.type_literal | None,
         Query(
             alias="status",
             description="The approval status of the exeats to be returned.",
         ),
     ] = None,
     sort: Annotated[
-        Literal["last_updated", "leave_start", "leave_end"],
+        ExeatSort,
         Query(
             description="The attribute to sort by. May be one of `last_updated` (default), `leave_start` or `leave_end`."
         ),
@@ -74,18 +109,62 @@ async def get_exeats(
     Only the exeats concerning the currently logged in staff are returned
     (i.e. all pending, and only specific exeats approved or denied by the staff).
     """
-    logger.info(f"Fetching pending exeat requests for staff ID {staff.id}")
-    # noinspection PyTypeChecker,Pydantic,PyComparisonWithNone
-    query: Select[ExeatRequest] = select(ExeatRequest).where(
-        or_(ExeatRequest.staff_id == staff.id, ExeatRequest.staff_id == None)
+    logger.info("Fetching pending exeat requests for staff ID {}", staff.id)
+    _status = EXEAT_REQUEST_STATUSES_BY_NAME[_status] if _status else None
+    # noinspection PyTypeChecker,Pydantic
+    status_criteria = (ExeatRequest.status_id == _status,) if _status else ()
+    return model_response(
+        await paginated_exeats_query(
+            db,
+            *status_criteria,
+            any_of=concerning_staff(staff.id),
+            cache_key=("staff", staff.id, _status),
+            page_size=page_size,
+            cursor=cursor,
+            sort=sort,
+            ascending=ascending,
+        )
     )
-    _status = ExeatRequestStatusEnum.from_safe_name(_status) if _status else None
-    return paginated_exeats_query(
-        db,
-        query,
-        page=page,
-        page_size=page_size,
-        status_id=_status,
+
+
+@router.get(
+    "/exeat/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def stream_exeats(
+    staff: Annotated[Staff, Depends(get_current_staff)],
+    _status: Annotated[
+        ExeatRequestStatusEnum.type_literal | None,
+        Query(
+            alias="status",
+            description="The approval status of the exeats to be returned.",
+        ),
+    ] = None,
+    sort: Annotated[
+        ExeatSort,
+        Query(
+            description="The attribute to sort by. May be one of `last_updated` (default), `leave_start` or `leave_end`."
+        ),
+    ] = "last_updated",
+    ascending: Annotated[
+        bool,
+        Query(
+            description="Whether or not to sort in ascending order. Defaults to `False` (descending order)."
+        ),
+    ] = False,
+):
+    """
+    Stream all exeat requests concerning the currently logged in staff, filtered by
+    status and sorted, as newline-delimited JSON. Suited to exporting them all at once.
+    """
+    logger.info("Streaming exeat requests for staff ID {}", staff.id)
+    _status = EXEAT_REQUEST_STATUSES_BY_NAME[_status] if _status else None
+    # noinspection PyTypeChecker,Pydantic
+    status_criteria = (ExeatRequest.status_id == _status,) if _status else ()
+    return stream_exeat_listing(
+        *status_criteria,
+        any_of=concerning_staff(staff.id),
         sort=sort,
         ascending=ascending,
     )
@@ -94,8 +173,9 @@ async def get_exeats(
 # noinspection PyUnusedLocal
 @router.get("/exeat/{exeat_id}", response_model=ExeatRequestResponse)
 async def get_exeat(
-    db: Annotated[Session, Depends(db_dependency)],
-    exeat_id: int,
+    request: Request,
+    db: DbDep,
+    exeat_id: ExeatIdPath,
     staff: Annotated[Staff, Depends(get_current_staff)],
 ):
     """
@@ -104,88 +184,178 @@ async def get_exeat(
     Only the exeats concerning the currently logged in staff are returned
     (i.e. all pending, and only specific approved or denied exeats).
     """
-    # noinspection PyTypeChecker,Pydantic,PyComparisonWithNone
-    query: Select[ExeatRequest] = (
-        select(ExeatRequest)
-        .where(ExeatRequest.id == exeat_id)
-        .where(or_(ExeatRequest.staff_id == staff.id, ExeatRequest.staff_id == None))
+    # A single row by primary key, so an OR across the cases costs nothing here.
+    return await exeat_etag_response(
+        request, db, exeat_id, or_(*concerning_staff(staff.id))
     )
-    try:
-        return db.exec(query).one()
-    except NoResultFound:
-        logger.error("Exeat request with ID {} not found", exeat_id)
-        raise error_exeat_request_not_found
 
 
-@router.post("/approve/{exeat_id}", response_model=ExeatRequestResponse)
-def approve_exeat_request(
-    db: Annotated[Session, Depends(db_dependency)],
-    staff: Annotated[Staff, Depends(get_current_staff)],
+async def _review_exeat_request(
+    db: AsyncSession,
+    staff: Staff,
     exeat_id: int,
-    comment: str | None = None,
-):
+    status_id: ExeatRequestStatusEnum,
+    comment: str | None,
+) -> ExeatRequest:
     """
-    Approve a pending exeat request and add an optional comment.
+    Approve or deny a pending exeat request with a single UPDATE ... RETURNING.
+    Only pending requests are matched, so two reviews can't both succeed.
     """
-    exeat_request = get_exeat_request(db, exeat_id)
-    if not exeat_request:
-        logger.error(f"Exeat request ID {exeat_id} not found for approval.")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Exeat request not found"
+    # noinspection PyTypeChecker,Pydantic
+    statement = (
+        update(ExeatRequest)
+        .where(
+            ExeatRequest.id == exeat_id,
+            ExeatRequest.status_id == ExeatRequestStatusEnum.PENDING,
         )
-
-    if exeat_request.status_id != ExeatRequestStatusEnum.PENDING:
-        logger.warning(f"Exeat request ID {exeat_id} is not pending.")
+        .values(
+            status_id=status_id,
+            staff_id=staff.id,
+            staff_comment=comment,
+            staff_review_time=utcnow(),
+        )
+        .returning(ExeatRequest)
+    )
+    exeat_request = (await db.exec(statement)).scalar_one_or_none()
+    if exeat_request is None:
+        # Nothing was updated; find out whether the request is missing or reviewed.
+        # noinspection PyTypeChecker,Pydantic
+        current_status = await db.scalar(
+            select(ExeatRequest.status_id).where(ExeatRequest.id == exeat_id)
+        )
+        if current_status is None:
+            logger.error("Exeat request ID {} not found for review.", exeat_id)
+            raise error_exeat_request_not_found
+        logger.warning("Exeat request ID {} is not pending.", exeat_id)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Request is not pending"
         )
+    await db.commit()
+    forget_cached_exeat_listings()
+    return exeat_request
 
-    # Update status to APPROVED
-    exeat_request.status_id = ExeatRequestStatusEnum.APPROVED
-    exeat_request.staff_id = staff.id
-    exeat_request.staff_comment = comment
-    exeat_request.staff_review_time = datetime.now(UTC)
-
-    db.merge(exeat_request)
-    db.commit()
-    db.refresh(exeat_request)
 
-    logger.info(f"Exeat request ID {exeat_id} approved by staff ID {staff.id}")
+@router.post("/approve/{exeat_id}", response_model=ExeatRequestResponse)
+async def approve_exeat_request(
+    db: DbDep,
+    staff: Annotated[Staff, Depends(get_current_staff)],
+    exeat_id: ExeatIdPath,
+    comment: StaffCommentQuery = None,
+):
+    """
+    Approve a pending exeat request and add an optional comment.
+    """
+    exeat_request = await _review_exeat_request(
+        db, staff, exeat_id, ExeatRequestStatusEnum.APPROVED, comment
+    )
+    logger.info("Exeat request ID {} approved by staff ID {}", exeat_id, staff.id)
     return exeat_request
 
 
 @router.post("/deny/{exeat_id}", response_model=ExeatRequestResponse)
-def deny_exeat_request(
-    db: Annotated[Session, Depends(db_dependency)],
+async def deny_exeat_request(
+    db: DbDep,
     staff: Annotated[Staff, Depends(get_current_staff)],
-    exeat_id: int,
-    comment: str | None = None,
+    exeat_id: ExeatIdPath,
+    comment: StaffCommentQuery = None,
 ):
     """
     Deny a pending exeat request and add an optional comment.
     """
-    exeat_request = get_exeat_request(db, exeat_id)
-    if not exeat_request:
-        logger.error(f"Exeat request ID {exeat_id} not found for denial.")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Exeat request not found"
+    exeat_request = await _review_exeat_request(
+        db, staff, exeat_id, ExeatRequestStatusEnum.DENIED, comment
+    )
+    logger.info("Exeat request ID {} denied by staff ID {}", exeat_id, staff.id)
+    return exeat_request
+
+
+async def _review_exeat_requests(
+    db: AsyncSession,
+    staff: Staff,
+    review: BatchReview,
+    status_id: ExeatRequestStatusEnum,
+) -> BatchReviewResponse:
+    """
+    Approve or deny many pending exeat requests with a single UPDATE ... RETURNING,
+    reporting those that were skipped as either missing or already reviewed.
+    """
+    ids = list(dict.fromkeys(review.ids))
+    # noinspection PyTypeChecker,Pydantic
+    statement = (
+        update(ExeatRequest)
+        .where(
+            ExeatRequest.id.in_(ids),
+            ExeatRequest.status_id == ExeatRequestStatusEnum.PENDING,
+        )
+        .values(
+            status_id=status_id,
+            staff_id=staff.id,
+            staff_comment=review.comment,
+            staff_review_time=utcnow(),
         )
+        .returning(ExeatRequest)
+    )
+    reviewed = (await db.exec(statement)).scalars().all()
+    if reviewed:
+        await db.commit()
+        forget_cached_exeat_listings()
 
-    if exeat_request.status_id != ExeatRequestStatusEnum.PENDING:
-        logger.warning(f"Exeat request ID {exeat_id} is not pending.")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Request is not pending"
+    reviewed_ids = {exeat_request.id for exeat_request in reviewed}
+    skipped = [exeat_id for exeat_id in ids if exeat_id not in reviewed_ids]
+    existing: set[int] = set()
+    if skipped:
+        # Only the skipped requests need telling apart; it takes one more query.
+        # noinspection PyTypeChecker,Pydantic
+        existing = set(
+            await db.exec(select(ExeatRequest.id).where(ExeatRequest.id.in_(skipped)))
         )
+    return BatchReviewResponse(
+        reviewed=[
+            ExeatRequestResponse.model_validate(exeat_request)
+            for exeat_request in reviewed
+        ],
+        not_found=[exeat_id for exeat_id in skipped if exeat_id not in existing],
+        not_pending=[exeat_id for exeat_id in skipped if exeat_id in existing],
+    )
 
-    # Update status to DENIED
-    exeat_request.status_id = ExeatRequestStatusEnum.DENIED
-    exeat_request.staff_id = staff.id
-    exeat_request.staff_comment = comment
-    exeat_request.staff_review_time = datetime.now(UTC)
 
-    db.merge(exeat_request)
-    db.commit()
-    db.refresh(exeat_request)
+@router.post("/approve", response_model=BatchReviewResponse)
+async def batch_approve_exeat_requests(
+    db: DbDep,
+    staff: Annotated[Staff, Depends(get_current_staff)],
+    review: BatchReview,
+):
+    """
+    Approve several pending exeat requests at once, with an optional shared comment.
+    Requests which don't exist or aren't pending are skipped, and listed as such.
+    """
+    response = await _review_exeat_requests(
+        db, staff, review, ExeatRequestStatusEnum.APPROVED
+    )
+    logger.info(
+        "{} exeat request(s) approved by staff ID {}",
+        len(response.reviewed),
+        staff.id,
+    )
+    return model_response(response)
 
-    logger.info(f"Exeat request ID {exeat_id} denied by staff ID {staff.id}")
-    return exeat_request
+
+@router.post("/deny", response_model=BatchReviewResponse)
+async def batch_deny_exeat_requests(
+    db: DbDep,
+    staff: Annotated[Staff, Depends(get_current_staff)],
+    review: BatchReview,
+):
+    """
+    Deny several pending exeat requests at once, with an optional shared comment.
+    Requests which don't exist or aren't pending are skipped, and listed as such.
+    """
+    response = await _review_exeat_requests(
+        db, staff, review, ExeatRequestStatusEnum.DENIED
+    )
+    logger.info(
+        "{} exeat request(s) denied by staff ID {}",
+        len(response.reviewed),
+        staff.id,
+    )
+    return model_response(response)
@@ -1,21 +1,32 @@
-from datetime import UTC, datetime
-from typing import Annotated, Literal
+from datetime import datetime
+from typing import Annotated, Self
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Request, status
 from fastapi.params import Query
+from fastapi.responses import StreamingResponse
 from loguru import logger
 from pydantic import BaseModel, Field, model_validator
-from sqlalchemy.exc import NoResultFound
-from sqlmodel import Session, select
-from sqlmodel.sql.expression import Select
 
-from ..db import ExeatRequest, ExeatRequestStatusEnum, Student, User, db_dependency
+from ..db import (
+    EXEAT_REQUEST_STATUSES_BY_NAME,
+    DbDep,
+    ExeatRequest,
+    ExeatRequestStatusEnum,
+    Student,
+    User,
+    create_exeat_request,
+)
 from .auth import get_current_student
 from .common import (
+    ExeatIdPath,
     ExeatRequestResponse,
+    ExeatSort,
     PaginatedExeatsResponse,
-    error_exeat_request_not_found,
+    exeat_etag_response,
+    forget_cached_exeat_listings,
+    model_response,
     paginated_exeats_query,
+    stream_exeat_listing,
 )
 
 title = "Student"
@@ -30,23 +41,27 @@ class ExeatRequestCreate(BaseModel):
         ..., description="End date and time for the leave request"
     )
     reason: str = Field(..., max_length=255, description="Reason for the leave request")
-    
+
     @model_validator(mode="after")
-    def check_times(self):
+    def check_times(self) -> Self:
         if self.leave_start > self.leave_end:
-            raise ValueError("The time of `leave_start` cannot be ahead of `leave_end`.")
+            raise ValueError(
+                "The time of `leave_start` cannot be ahead of `leave_end`."
+            )
+        return self
+
 
 @router.get("/exeat", response_model=PaginatedExeatsResponse)
 async def get_exeats(
-    db: Annotated[Session, Depends(db_dependency)],
+    db: DbDep,
     student: Annotated[Student, Depends(get_current_student)],
-    page: Annotated[
-        int,
+    cursor: Annotated[
+        str | None,
         Query(
-            ge=1,
-            description="The page number to fetch. If the provided value exceeds the possible number of pages, the last page will be returned",
+            description="The `next_cursor` of the previous page, to fetch the page after it. "
+            "Omit to fetch the first page.",
         ),
-    ] = 1,  # Page number, default to 1
+    ] = None,
     page_size: Annotated[
         int,
         Query(
@@ -57,14 +72,14 @@ async def get_exeats(
         ),
     ] = 20,  # Page size, default to 20, max 100
     _status: Annotated[
-        str,
+        ExeatRequestStatusEnum.type_literal | None,
         Query(
             alias="status",
             description="The approval status of the exeats to be returned.",
         ),
     ] = None,
     sort: Annotated[
-        Literal["last_updated", "leave_start", "leave_end"],
+        ExeatSort,
         Query(
             description="The attribute to sort by. May be one of `last_updated` (default), `leave_start` or `leave_end`."
         ),
@@ -79,46 +94,89 @@ async def get_exeats(
     """
     Retrieve all exeat requests submitted by the logged-in student, filtered by status and sorted.
     """
-    logger.info(f"Fetching pending exeat requests for student ID {student.id}")
+    logger.info("Fetching pending exeat requests for student ID {}", student.id)
     # Retrieve exeat requests for the student
+    _status = EXEAT_REQUEST_STATUSES_BY_NAME[_status] if _status else None
     # noinspection PyTypeChecker,Pydantic
-    query: Select[ExeatRequest] = select(ExeatRequest).where(
-        ExeatRequest.student_id == student.id
-    )
-    _status = ExeatRequestStatusEnum.from_safe_name(_status) if _status else None
-    return paginated_exeats_query(
-        db,
-        query,
-        page=page,
-        page_size=page_size,
-        status_id=_status,
-        sort=sort,
-        ascending=ascending,
+    criteria = [ExeatRequest.student_id == student.id]
+    if _status:
+        # noinspection PyTypeChecker,Pydantic
+        criteria.append(ExeatRequest.status_id == _status)
+    return model_response(
+        await paginated_exeats_query(
+            db,
+            *criteria,
+            cache_key=("student", student.id, _status),
+            page_size=page_size,
+            cursor=cursor,
+            sort=sort,
+            ascending=ascending,
+        )
     )
 
 
+@router.get(
+    "/exeat/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def stream_exeats(
+    student: Annotated[Student, Depends(get_current_student)],
+    _status: Annotated[
+        ExeatRequestStatusEnum.type_literal | None,
+        Query(
+            alias="status",
+            description="The approval status of the exeats to be returned.",
+        ),
+    ] = None,
+    sort: Annotated[
+        ExeatSort,
+        Query(
+            description="The attribute to sort by. May be one of `last_updated` (default), `leave_start` or `leave_end`."
+        ),
+    ] = "last_updated",
+    ascending: Annotated[
+        bool,
+        Query(
+            description="Whether or not to sort in ascending order. Defaults to `False` (descending order)."
+        ),
+    ] = False,
+):
+    """
+    Stream all exeat requests submitted by the logged-in student, filtered by status and
+    sorted, as newline-delimited JSON. Suited to exporting a full history at once.
+    """
+    logger.info("Streaming exeat requests for student ID {}", student.id)
+    _status = EXEAT_REQUEST_STATUSES_BY_NAME[_status] if _status else None
+    # noinspection PyTypeChecker,Pydantic
+    criteria = [ExeatRequest.student_id == student.id]
+    if _status:
+        # noinspection PyTypeChecker,Pydantic
+        criteria.append(ExeatRequest.status_id == _status)
+    return stream_exeat_listing(*criteria, sort=sort, ascending=ascending)
+
+
 @router.get("/exeat/{exeat_id}", response_model=ExeatRequestResponse)
 async def get_exeat(
-    exeat_id: int,
-    db: Annotated[Session, Depends(db_dependency)],
+    request: Request,
+    exeat_id: ExeatIdPath,
+    db: DbDep,
     current_student: Annotated[User, Depends(get_current_student)],
 ):
     """
     Retrieve a specific exeat request submitted by the logged-in student by its ID.
     """
     logger.info(
-        f"Fetching exeat request with ID {exeat_id} for student ID {current_student.id}"
+        "Fetching exeat request with ID {} for student ID {}",
+        exeat_id,
+        current_student.id,
     )
+    # Clients polling for a review can revalidate with the ETag, getting an empty 304
+    # until the request changes.
     # noinspection PyTypeChecker,Pydantic
-    query: Select[ExeatRequest] = select(ExeatRequest).where(
-        ExeatRequest.student_id == current_student.id,
-        ExeatRequest.id == exeat_id,
+    return await exeat_etag_response(
+        request, db, exeat_id, ExeatRequest.student_id == current_student.id
     )
-    try:
-        return db.exec(query).one()
-    except NoResultFound:
-        logger.error("Exeat request with ID {} not found", exeat_id)
-        raise error_exeat_request_not_found
 
 
 @router.post(
@@ -128,28 +186,29 @@ async def get_exeat(
 )
 async def submit_exeat_request(
     exeat_request: ExeatRequestCreate,
-    db: Annotated[Session, Depends(db_dependency)],
+    db: DbDep,
     current_student: Annotated[Student, Depends(get_current_student)],
 ):
     """
     Allows students to submit a new exeat request.
     """
-    # Create the new exeat request
-    new_exeat_request = ExeatRequest(
-        student_id=current_student.id,
-        leave_start=exeat_request.leave_start,
-        leave_end=exeat_request.leave_end,
-        reason=exeat_request.reason,
-        status_id=ExeatRequestStatusEnum.PENDING,  # Initial status as pending
-        submission_time=datetime.now(UTC),
+    # Inserted with a single INSERT ... RETURNING, which also brings back the ID and
+    # the database-stamped submission time.
+    new_exeat_request = await create_exeat_request(
+        db,
+        ExeatRequest(
+            student_id=current_student.id,
+            leave_start=exeat_request.leave_start,
+            leave_end=exeat_request.leave_end,
+            reason=exeat_request.reason,
+            status_id=ExeatRequestStatusEnum.PENDING,  # Initial status as pending
+        ),
     )
-
-    # Add to the database and commit
-    db.add(new_exeat_request)
-    db.commit()
-    db.refresh(new_exeat_request)
+    forget_cached_exeat_listings()
 
     logger.info(
-        f"Student {current_student.id} submitted a new exeat request with ID {new_exeat_request.id}."
+        "Student {} submitted a new exeat request with ID {}.",
+        current_student.id,
+        new_exeat_request.id,
     )
     return new_exeat_request
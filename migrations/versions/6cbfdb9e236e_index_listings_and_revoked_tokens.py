@@ -0,0 +1,110 @@
+"""
+Index exeat listings by last update and revoked tokens by signature and expiry
+
+Revision ID: 6cbfdb9e236e
+Revises:
+Create Date: 2026-10-15 22:11:48.328428
+
+Databases created by `init_db` since these indexes were declared already have them,
+hence `if_exists` and `if_not_exists` throughout.
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6cbfdb9e236e"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+last_updated = sa.text("coalesce(staff_review_time, submission_time)")
+
+
+def upgrade() -> None:
+    # Superseded by the composite indexes below, which lead with these columns.
+    op.drop_index("ix_exeat_request_student_id", "exeat_request", if_exists=True)
+    op.drop_index("ix_exeat_request_status_id", "exeat_request", if_exists=True)
+    op.drop_index("ix_exeat_request_staff_id", "exeat_request", if_exists=True)
+    op.create_index(
+        "ix_exeat_last_updated", "exeat_request", [last_updated], if_not_exists=True
+    )
+    op.create_index(
+        "ix_exeat_status_updated",
+        "exeat_request",
+        ["status_id", last_updated],
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_exeat_staff_status_updated",
+        "exeat_request",
+        ["staff_id", "status_id", last_updated],
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_exeat_student_status_updated",
+        "exeat_request",
+        ["student_id", "status_id", last_updated],
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_exeat_staff_leave_start",
+        "exeat_request",
+        ["staff_id", "leave_start"],
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_exeat_staff_leave_end",
+        "exeat_request",
+        ["staff_id", "leave_end"],
+        if_not_exists=True,
+    )
+
+    # The primary key already makes `sig` unique.
+    op.drop_index("ix_revoked_token_sig", "revoked_token", if_exists=True)
+    op.drop_index("ix_revoked_token_exp", "revoked_token", if_exists=True)
+    op.create_index(
+        "revoked_token_sig_hash",
+        "revoked_token",
+        ["sig"],
+        postgresql_using="hash",
+        if_not_exists=True,
+    )
+    op.create_index(
+        "revoked_token_exp_idx", "revoked_token", ["exp"], if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("revoked_token_exp_idx", "revoked_token", if_exists=True)
+    op.drop_index("revoked_token_sig_hash", "revoked_token", if_exists=True)
+    op.create_index(
+        "ix_revoked_token_exp", "revoked_token", ["exp"], if_not_exists=True
+    )
+    op.create_index(
+        "ix_revoked_token_sig",
+        "revoked_token",
+        ["sig"],
+        unique=True,
+        if_not_exists=True,
+    )
+
+    for name in (
+        "ix_exeat_staff_leave_end",
+        "ix_exeat_staff_leave_start",
+        "ix_exeat_student_status_updated",
+        "ix_exeat_staff_status_updated",
+        "ix_exeat_status_updated",
+        "ix_exeat_last_updated",
+    ):
+        op.drop_index(name, "exeat_request", if_exists=True)
+    for column in ("staff_id", "status_id", "student_id"):
+        op.create_index(
+            f"ix_exeat_request_{column}",
+            "exeat_request",
+            [column],
+            if_not_exists=True,
+        )
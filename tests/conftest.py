@@ -0,0 +1,76 @@
+import os
+from tempfile import mkdtemp
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+# The settings and engine are read at import, so point them at a scratch database first.
+os.environ["DB_URL"] = f"sqlite+aiosqlite:///{mkdtemp()}/buems.db"
+os.environ.setdefault("SECRET_KEY", "test-secret-key-of-at-least-32-bytes")
+# The cheapest cost bcrypt allows, to keep signups fast.
+os.environ.setdefault("BCRYPT_COST", "4")
+
+from buems.__main__ import app  # noqa: E402
+from buems.db import init_db  # noqa: E402
+from buems.db.db import sessionmaker_instance  # noqa: E402
+
+# Fields required by each user type on signup.
+PROFILE_FIELDS = {
+    "student": {
+        "matriculation_number": "2021/1234",
+        "course_of_study": "Computer Science",
+        "guardian_name": "Ada Doe",
+        "guardian_phone_number": "08000000001",
+        "guardian_relationship": "Mother",
+    },
+    "staff": {"staff_id": "ST-001", "designation": "Hall Warden"},
+    "security_operative": {"security_id": "SO-001", "designation": "Gatekeeper"},
+}
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db(anyio_backend):
+    await init_db()
+    async with sessionmaker_instance() as session:
+        yield session
+
+
+@pytest.fixture
+async def client(db):
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        yield client
+
+
+@pytest.fixture
+def sign_up(client):
+    """
+    Sign up a user of the given type, returning the headers authenticating as them.
+    """
+    count = 0
+
+    async def sign_up(user_type: str) -> dict[str, str]:
+        nonlocal count
+        count += 1
+        response = await client.post(
+            "/signup",
+            json={
+                "user_type": user_type,
+                "email": f"{user_type}-{id(sign_up)}-{count}@example.com",
+                "password": "correct horse battery staple",
+                "first_name": "Test",
+                "last_name": "User",
+                "phone_number": "08000000000",
+                **PROFILE_FIELDS[user_type],
+            },
+        )
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    return sign_up
@@ -0,0 +1,74 @@
+from datetime import UTC, datetime, timedelta
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from buems.routers import account
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("user_type", ["student", "staff", "security_operative"])
+async def test_delete_account_with_profile(client, sign_up, user_type):
+    headers = await sign_up(user_type)
+    profile = await client.get("/account/profile", headers=headers)
+    assert profile.status_code == 200
+
+    response = await client.delete("/account/delete", headers=headers)
+    assert response.status_code == 200, response.text
+
+    # The token's user no longer exists.
+    assert (await client.get("/account/", headers=headers)).status_code == 401
+
+
+async def test_delete_student_account_with_exeat_requests(client, sign_up):
+    headers = await sign_up("student")
+    leave_start = datetime.now(UTC) + timedelta(days=1)
+    submitted = await client.post(
+        "/student/submit",
+        headers=headers,
+        json={
+            "leave_start": leave_start.isoformat(),
+            "leave_end": (leave_start + timedelta(days=2)).isoformat(),
+            "reason": "Visiting family",
+        },
+    )
+    assert submitted.status_code == 201, submitted.text
+
+    response = await client.delete("/account/delete", headers=headers)
+    assert response.status_code == 200, response.text
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG", "WEBP"])
+async def test_upload_profile_picture(
+    client, sign_up, monkeypatch, tmp_path, image_format
+):
+    monkeypatch.setattr(account, "PROFILE_PICTURE_PATH", tmp_path)
+    headers = await sign_up("student")
+    image = BytesIO()
+    Image.new("RGB", (1200, 800), "teal").save(image, format=image_format)
+
+    response = await client.post(
+        "/account/upload-profile-picture",
+        headers=headers,
+        files={"file": ("picture", image.getvalue())},
+    )
+    assert response.status_code == 200, response.text
+
+    (thumbnail,) = tmp_path.iterdir()
+    with Image.open(thumbnail) as saved:
+        assert saved.format == "WEBP"
+        assert max(saved.size) == 300
+    account_info = (await client.get("/account/", headers=headers)).json()
+    assert account_info["profile_picture"].endswith(thumbnail.name)
+
+
+async def test_upload_rejects_non_images(client, sign_up):
+    headers = await sign_up("student")
+    response = await client.post(
+        "/account/upload-profile-picture",
+        headers=headers,
+        files={"file": ("picture", b"not an image")},
+    )
+    assert response.status_code == 400
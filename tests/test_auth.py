@@ -0,0 +1,33 @@
+import pytest
+
+from buems.routers import auth
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_token_rejected_after_logout(client, sign_up):
+    headers = await sign_up("student")
+    assert (await client.get("/account/", headers=headers)).status_code == 200
+
+    response = await client.post("/revoke", headers=headers)
+    assert response.status_code == 204
+
+    assert (await client.get("/account/", headers=headers)).status_code == 401
+
+
+async def test_request_during_logout_does_not_keep_token_usable(
+    client, sign_up, monkeypatch
+):
+    headers = await sign_up("staff")
+    revoke_jwt = auth.revoke_jwt
+
+    async def revoke_jwt_with_concurrent_request(*args, **kwargs):
+        # Another request with the same token arrives while the revocation is written.
+        assert (await client.get("/account/", headers=headers)).status_code == 200
+        await revoke_jwt(*args, **kwargs)
+
+    monkeypatch.setattr(auth, "revoke_jwt", revoke_jwt_with_concurrent_request)
+    response = await client.post("/revoke", headers=headers)
+    assert response.status_code == 204
+
+    assert (await client.get("/account/", headers=headers)).status_code == 401
@@ -0,0 +1,50 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlmodel import update
+from starlette.requests import Request
+
+from buems.db import ExeatRequest, ExeatRequestStatusEnum, create_exeat_request
+from buems.routers.common import exeat_etag_response
+
+pytestmark = pytest.mark.anyio
+
+
+def make_request(if_none_match: str | None = None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "headers": headers})
+
+
+async def test_review_changes_etag_despite_same_timestamp(db):
+    leave_start = datetime.now(UTC) + timedelta(days=1)
+    exeat_request = await create_exeat_request(
+        db,
+        ExeatRequest(
+            student_id=1,
+            leave_start=leave_start,
+            leave_end=leave_start + timedelta(days=1),
+            reason="Visiting family",
+            status_id=ExeatRequestStatusEnum.PENDING,
+        ),
+    )
+    response = await exeat_etag_response(make_request(), db, exeat_request.id)
+    etag = response.headers["ETag"]
+    cached = await exeat_etag_response(make_request(etag), db, exeat_request.id)
+    assert cached.status_code == 304
+
+    # Reviewed with a timestamp equal to the submission's, as whole-second clocks give.
+    # noinspection PyTypeChecker,Pydantic
+    await db.exec(
+        update(ExeatRequest)
+        .where(ExeatRequest.id == exeat_request.id)
+        .values(
+            status_id=ExeatRequestStatusEnum.APPROVED,
+            staff_id=1,
+            staff_review_time=exeat_request.submission_time,
+        )
+    )
+    await db.commit()
+
+    revalidated = await exeat_etag_response(make_request(etag), db, exeat_request.id)
+    assert revalidated.status_code == 200
+    assert revalidated.headers["ETag"] != etag
@@ -0,0 +1,87 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlmodel import delete
+
+from buems.db import ExeatRequest, ExeatRequestStatusEnum, create_exeat_request
+from buems.routers.common import paginated_exeats_query
+from buems.routers.staff import concerning_staff
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_cursor_pages_past_the_first_page(db):
+    await db.exec(delete(ExeatRequest))
+    await db.commit()
+    leave_start = datetime.now(UTC) + timedelta(days=1)
+    # Submitted within the same second, as a burst of requests would be.
+    ids = [
+        (
+            await create_exeat_request(
+                db,
+                ExeatRequest(
+                    student_id=1,
+                    leave_start=leave_start,
+                    leave_end=leave_start + timedelta(days=1),
+                    reason="Visiting family",
+                    status_id=ExeatRequestStatusEnum.PENDING,
+                ),
+            )
+        ).id
+        for _ in range(7)
+    ]
+
+    seen = []
+    cursor = None
+    for _ in range(len(ids)):
+        page = await paginated_exeats_query(db, page_size=3, cursor=cursor)
+        assert page.total_items == len(ids)
+        seen.extend(item.id for item in page.items)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+
+    # Newest first, each exactly once.
+    assert seen == ids[::-1]
+
+
+async def test_cursor_pages_through_merged_branches(db):
+    await db.exec(delete(ExeatRequest))
+    await db.commit()
+    leave_start = datetime.now(UTC) + timedelta(days=1)
+    staff_ids = [1, None, 2, 1, None, None, 2, 1]
+    ids = [
+        (
+            await create_exeat_request(
+                db,
+                ExeatRequest(
+                    student_id=1,
+                    staff_id=staff_id,
+                    leave_start=leave_start,
+                    leave_end=leave_start + timedelta(days=1),
+                    reason="Visiting family",
+                    status_id=ExeatRequestStatusEnum.PENDING,
+                ),
+            )
+        ).id
+        for staff_id in staff_ids
+    ]
+    expected = [
+        exeat_id
+        for exeat_id, staff_id in zip(ids, staff_ids, strict=True)
+        if staff_id in (1, None)
+    ][::-1]
+
+    seen = []
+    cursor = None
+    for _ in range(len(ids)):
+        page = await paginated_exeats_query(
+            db, any_of=concerning_staff(1), page_size=2, cursor=cursor
+        )
+        assert page.total_items == len(expected)
+        seen.extend(item.id for item in page.items)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+
+    assert seen == expected
@@ -0,0 +1,85 @@
+from datetime import UTC, datetime, timedelta
+
+import orjson
+import pytest
+from sqlmodel import delete
+
+from buems.db import ExeatRequest
+
+pytestmark = pytest.mark.anyio
+
+
+async def submit_exeat_requests(client, headers, count: int) -> list[int]:
+    leave_start = datetime.now(UTC) + timedelta(days=1)
+    ids = []
+    for _ in range(count):
+        submitted = await client.post(
+            "/student/submit",
+            headers=headers,
+            json={
+                "leave_start": leave_start.isoformat(),
+                "leave_end": (leave_start + timedelta(days=2)).isoformat(),
+                "reason": "Visiting family",
+            },
+        )
+        assert submitted.status_code == 201, submitted.text
+        ids.append(submitted.json()["id"])
+    return ids
+
+
+async def test_batch_review_reports_skipped_requests(client, sign_up):
+    student = await sign_up("student")
+    staff = await sign_up("staff")
+    first, second, third = await submit_exeat_requests(client, student, 3)
+    missing = 2**31 - 1
+
+    approved = await client.post(
+        "/staff/approve",
+        headers=staff,
+        json={"ids": [first, second, first, missing], "comment": "Safe trip"},
+    )
+    assert approved.status_code == 200, approved.text
+    body = approved.json()
+    assert [item["id"] for item in body["reviewed"]] == [first, second]
+    assert {item["status"] for item in body["reviewed"]} == {"approved"}
+    assert {item["staff_comment"] for item in body["reviewed"]} == {"Safe trip"}
+    assert all(item["staff_date"] for item in body["reviewed"])
+    assert body["not_found"] == [missing]
+    assert body["not_pending"] == []
+
+    denied = await client.post(
+        "/staff/deny", headers=staff, json={"ids": [second, third]}
+    )
+    assert denied.status_code == 200, denied.text
+    body = denied.json()
+    assert [item["id"] for item in body["reviewed"]] == [third]
+    assert body["reviewed"][0]["status"] == "denied"
+    assert body["not_found"] == []
+    assert body["not_pending"] == [second]
+
+    # The second review didn't overwrite the first.
+    exeat = await client.get(f"/staff/exeat/{second}", headers=staff)
+    assert exeat.json()["status"] == "approved"
+
+
+async def test_stream_exeats(db, client, sign_up):
+    await db.exec(delete(ExeatRequest))
+    await db.commit()
+    student = await sign_up("student")
+    staff = await sign_up("staff")
+    ids = await submit_exeat_requests(client, student, 3)
+    approved = await client.post("/staff/approve", headers=staff, json={"ids": ids[:1]})
+    assert approved.status_code == 200, approved.text
+
+    response = await client.get("/staff/exeat/stream", headers=staff)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    # Most recently updated first: the approval came after every submission.
+    assert [orjson.loads(line)["id"] for line in lines] == [ids[0], *ids[:0:-1]]
+
+    pending = await client.get(
+        "/staff/exeat/stream", headers=staff, params={"status": "pending"}
+    )
+    pending_ids = [orjson.loads(line)["id"] for line in pending.text.splitlines()]
+    assert pending_ids == ids[:0:-1]